@@ -0,0 +1,94 @@
+"""Replay historical monthly returns: the profile simulated from every rolling start month of a return history.
+
+The history is a local CSV or Parquet file with one column of monthly returns (0.01 for +1%) per asset class, and
+optionally a date column. Every investment type mapped onto an asset class grows by that class's return instead of
+its interest_rate, debts and unmapped investments keep their fixed rates. All windows run as one batch."""
+import os
+import polars as pl
+import numpy as np
+from batch import FinancialProfileBatch
+from objects import FinancialProfile
+
+def read_returns(path : str, date_column : str = None) -> pl.DataFrame:
+    """Monthly returns of a .csv or .parquet file (memory-mapped where the format allows)."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".parquet":
+        returns = pl.read_parquet(path, memory_map=True)
+    elif extension == ".csv":
+        returns = pl.read_csv(path)
+    else:
+        raise ValueError(f"Unknown returns file type {extension}, use .csv or .parquet.")
+    if date_column is not None and date_column not in returns.columns:
+        raise ValueError(f"No {date_column} column in {path}.")
+    asset_columns = [column for column in returns.columns if column != date_column]
+    if returns.select(asset_columns).null_count().sum_horizontal().item() > 0:
+        raise ValueError(f"Returns in {path} must not have missing months.")
+    return returns.with_columns(pl.col(asset_columns).cast(pl.Float64))
+
+class BacktestBatch(FinancialProfileBatch):
+    """FinancialProfileBatch where scenario i is the profile started at month starts[i] of a return history.
+
+    history: (n_months, n_mapped) monthly returns, one column per mapped investment type in the order of types."""
+
+    def __init__(self, profiles : list[FinancialProfile], types : list, history : np.ndarray, starts : np.ndarray):
+        super().__init__(profiles)
+        self.history = history
+        self.starts = starts
+        self.month = 0
+        investment_groups = [self.short_term_investments, self.employer_matched_investments, self.employer_flat_rate_investments,
+                             self.other_ira_investments, self.other_investments]
+        self.historical_columns = []
+        for fund_type in types:
+            groups = [group for group in investment_groups if fund_type in group.types]
+            if len(groups) == 0:
+                raise ValueError(f"No investment of type {fund_type} to replay returns for.")
+            column = groups[0].types.index(fund_type)
+            groups[0].growth[:, column] = 1.0 # The history replaces the fixed rate
+            self.historical_columns.append((groups[0], column))
+
+    def mature_accounts(self):
+        super().mature_accounts()
+        growth = 1 + self.history[self.starts + self.month]
+        for index, (group, column) in enumerate(self.historical_columns):
+            group.balances[:, column] *= growth[:, index]
+        self.month+=1
+
+def run_backtest(profile : FinancialProfile, years : int, returns : pl.DataFrame, asset_classes : dict, date_column : str = None) -> dict:
+    """Simulate a profile over every window of years*12 months in a return history (see read_returns).
+
+    asset_classes: {investment type : returns column}, i.e. {"401K" : "stocks", "Savings" : "cash"}.
+    Returns {"Windows" : final balances and Net Worth per start month,
+             "Trajectories" : every month of the windows with the Worst, Median and Best final net worth}."""
+    months = years*12
+    missing = [asset for asset in asset_classes.values() if asset not in returns.columns]
+    if missing:
+        raise ValueError(f"No return columns {', '.join(missing)}.")
+    n_windows = returns.height - months + 1
+    if n_windows < 1:
+        raise ValueError(f"{returns.height} months of returns are too few for a {years} year window.")
+    history = returns.select(list(asset_classes.values())).to_numpy()
+    starts = np.arange(n_windows)
+    batch = BacktestBatch([profile]*n_windows, list(asset_classes), history, starts)
+    batch.record = False
+    account_types = [account_type for group in batch.account_groups for account_type in group.types]
+    trajectories = np.zeros((months, n_windows, len(account_types)))
+    for month in range(months):
+        batch.advance_one_month()
+        trajectories[month] = batch.account_balances
+    debt_columns = [account_types.index(debt_type) for debt_type in batch.debts.types]
+    sign = np.ones(len(account_types))
+    sign[debt_columns] = -1
+    net_worth = trajectories @ sign # (months, n_windows)
+
+    start_labels = returns[date_column][:n_windows] if date_column is not None else pl.Series(starts)
+    windows = pl.DataFrame(dict({"Start" : start_labels},
+                                **{account_type : trajectories[-1, :, column] for column, account_type in enumerate(account_types)},
+                                **{"Net Worth" : net_worth[-1]}))
+    ranked = np.argsort(net_worth[-1], kind="stable")
+    cases = dict({"Worst" : ranked[0], "Median" : ranked[(n_windows - 1)//2], "Best" : ranked[-1]})
+    years_past = np.cumsum(np.concatenate([[profile.years_past], np.full(months, 1/12)]))[1:]
+    trajectory_frames = [pl.DataFrame(dict({"Case" : [case]*months, "Start" : start_labels.gather([window]*months), "Years" : years_past},
+                                           **{account_type : trajectories[:, window, column] for column, account_type in enumerate(account_types)},
+                                           **{"Net Worth" : net_worth[:, window]}))
+                         for case, window in cases.items()]
+    return dict({"Windows" : windows, "Trajectories" : pl.concat(trajectory_frames, how="vertical")})
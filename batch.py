@@ -0,0 +1,325 @@
+import polars as pl
+import numpy as np
+from helper_functions import TaxSchedule
+from objects import FinancialProfile, MonthlyRecorder, ResultTables, derived_tables
+from policy import STEP_METHODS, STEP_NAMES
+
+class AccountGroup:
+    """One account category of a batch (i.e. all debts) as a (n_scenarios, n_accounts) balance array.
+
+    Columns follow the first profile's ordering, order holds each scenario's own payment order."""
+
+    def __init__(self, account_lists : list[list]):
+        self.types = [account.type for account in account_lists[0]]
+        if len(set(self.types)) != len(self.types):
+            raise ValueError("Account types must be unique within an account category.")
+        n_scenarios, n_accounts = len(account_lists), len(self.types)
+        self.balances = np.zeros((n_scenarios, n_accounts))
+        self.rates = np.zeros((n_scenarios, n_accounts))
+        self.growth = np.ones((n_scenarios, n_accounts))
+        order = np.zeros((n_scenarios, n_accounts), dtype=np.int64)
+        for scenario, accounts in enumerate(account_lists):
+            if sorted(account.type for account in accounts) != sorted(self.types):
+                raise ValueError("Every scenario in a batch needs the same account types.")
+            for rank, account in enumerate(accounts):
+                column = self.types.index(account.type)
+                order[scenario, rank] = column
+                self.balances[scenario, column] = account.outstanding_balance
+                self.rates[scenario, column] = account.interest_rate
+                self.growth[scenario, column] = account.monthly_growth
+        # Index per rank, plain column slices when every scenario shares the same order
+        rows = np.arange(n_scenarios)
+        if (order == order[0]).all():
+            self.ranked = [(slice(None), column) for column in order[0]]
+        else:
+            self.ranked = [(rows, order[:, rank]) for rank in range(n_accounts)]
+
+    @property
+    def size(self):
+        return len(self.types)
+
+    def mature_one_month(self):
+        self.balances *= self.growth
+
+    def contribute_evenly(self, amount):
+        """Split an amount per scenario equally across the accounts in the group."""
+        if self.size:
+            self.balances += (amount / self.size)[:, None]
+
+class FinancialProfileBatch:
+    """Simulates many FinancialProfiles with the same accounts in lockstep.
+
+    Every balance, income and limit is held as a (n_scenarios, ...) numpy array and each waterfall step
+    runs as masked vectorized operations across all scenarios at once. The source profiles are not mutated."""
+
+    def __init__(self, profiles : list[FinancialProfile]):
+        if len(profiles) == 0:
+            raise ValueError("A batch needs at least one profile.")
+        first = profiles[0]
+        self.n_scenarios = len(profiles)
+        self.federal_tax_brackets = first.federal_tax_brackets
+        if any(profile.federal_tax_brackets != self.federal_tax_brackets for profile in profiles):
+            raise ValueError("Every scenario in a batch needs the same federal tax brackets.")
+        self.layout = first.recorder_layout()
+        if any(set(profile.recorder_layout()["Spent"].items()) != set(self.layout["Spent"].items()) for profile in profiles):
+            raise ValueError("Every scenario in a batch needs the same needs, debts and investments.")
+        if any(len(profile.timeline) > 0 for profile in profiles):
+            raise ValueError("Scheduled events are not supported in a batch, simulate those profiles one by one.")
+
+        # Accounts
+        self.debts = AccountGroup([profile.debts for profile in profiles])
+        self.short_term_investments = AccountGroup([profile.short_term_investments for profile in profiles])
+        self.employer_matched_investments = AccountGroup([profile.employer_matched_investments for profile in profiles])
+        self.employer_flat_rate_investments = AccountGroup([profile.employer_flat_rate_investments for profile in profiles])
+        self.other_ira_investments = AccountGroup([profile.other_ira_investments for profile in profiles])
+        self.other_investments = AccountGroup([profile.other_investments for profile in profiles])
+        self.account_groups = [self.short_term_investments, self.debts, self.employer_matched_investments,
+                               self.employer_flat_rate_investments, self.other_ira_investments, self.other_investments]
+        rows = np.arange(self.n_scenarios)
+        self.excess_401_index = (rows, np.array([self.employer_matched_investments.types.index(
+            profile.investments["Employer Matched Retirement"]["401K"].type) for profile in profiles]))
+        self.excess_IRA_index = (rows, np.array([self.other_ira_investments.types.index(
+            profile.investments["IRA"]["IRA"].type) for profile in profiles]))
+        self.highest_interest_debt = self.debts.rates.max(axis=1, initial=-np.inf)
+
+        # Income, contributions and needs (constant over the run)
+        self.gross_income = np.array([np.sum([job.salary for job in profile.employer_benefits.values()]) for profile in profiles])
+        self.tax_schedule = TaxSchedule(federal_tax_brackets = self.federal_tax_brackets,
+                                        standard_deduction = np.array([profile.standard_deduction for profile in profiles], dtype=np.float64),
+                                        state_tax_rate = np.array([profile.state_tax_rate for profile in profiles], dtype=np.float64),
+                                        fica_rate = np.array([profile.fica_rate for profile in profiles], dtype=np.float64))
+        self.monthly_net_income_pre_deductions = np.array([profile.monthly_net_income(additional_deductions=0) for profile in profiles])
+        contributions = [profile.monthly_pre_net_income_investment_contributions for profile in profiles]
+        self.matching_amounts = np.array([[contribution[fund_type] for fund_type in self.employer_matched_investments.types]
+                                          for contribution in contributions]).reshape(self.n_scenarios, -1)
+        self.flat_rate_amounts = np.array([[contribution[fund_type] for fund_type in self.employer_flat_rate_investments.types]
+                                           for contribution in contributions], dtype=np.float64).reshape(self.n_scenarios, -1)
+        self.need_columns = [column for column in self.layout["Spent"]
+                             if column in first.monthly_needs_spent_dict]
+        need_dicts = [profile.monthly_needs_spent_dict for profile in profiles]
+        self.need_spend = dict({column : np.array([need_dict[column] for need_dict in need_dicts]) for column in self.need_columns})
+        self.total_need_spend = np.array([np.sum([need_object.monthly_necessity_costs for need_object in profile.monthly_needs.values()])
+                                          for profile in profiles], dtype=np.float64)
+        self.monthly_need_expendature = np.array([profile.monthly_need_expendature for profile in profiles], dtype=np.float64)
+
+        # Policy knobs
+        self.maximum_monthly_loan_payment = np.array([profile.maximum_monthly_loan_payment for profile in profiles], dtype=np.float64)
+        self.max_401K_legal = np.array([profile.max_401K_legal for profile in profiles], dtype=np.float64)
+        self.max_IRA_legal = np.array([profile.max_IRA_legal for profile in profiles], dtype=np.float64)
+        self.prioritize_matching_over_emergency_fund = np.array([profile.prioritize_matching_over_emergency_fund for profile in profiles])
+        self.savings_leftover_percent = np.array([profile.savings_leftover_percent for profile in profiles], dtype=np.float64)
+        self.leisure_leftover_percent = np.array([profile.leisure_leftover_percent for profile in profiles], dtype=np.float64)
+        policies = [profile.allocation_policy for profile in profiles]
+        self.emergency_fund_months, self.high_interest_rate = np.array([list(policy.settings("emergency_fund").values()) for policy in policies],
+                                                                       dtype=np.float64).reshape(self.n_scenarios, 2).T
+        self.ira_yearly_limit = np.array([policy.settings("ira")["yearly_limit"] for policy in policies], dtype=np.float64)
+        self.post_deduction_savings_share = np.array([policy.post_deduction_savings_share for policy in policies], dtype=np.float64)
+        self.plan = self.compile_plan(policies)
+
+        # Running state
+        self.years_past = np.array([profile.years_past for profile in profiles], dtype=np.float64)
+        self.current_month_leftover_net_income = np.array([profile.current_month_leftover_net_income for profile in profiles], dtype=np.float64)
+        self.matching_amounts_left = self.matching_amounts.copy()
+        self.spent_401 = np.zeros(self.n_scenarios)
+        self.spent_IRA = np.zeros(self.n_scenarios)
+        self.recorder = None
+        self.record = True
+
+    def compile_plan(self, policies : list) -> list:
+        """Per step position, the (step index, method, arguments) of every step some scenario runs there.
+
+        A step every scenario runs at that position is called plainly, otherwise once per step with a mask of its
+        scenarios (i.e. matching for the scenarios prioritizing it, the emergency fund for the others)."""
+        plan = []
+        for position in range(len(STEP_NAMES)):
+            steps = np.array([policy.order[position] for policy in policies])
+            position_plan = []
+            for step in dict.fromkeys(steps.tolist()):
+                mask = steps == step
+                position_plan.append((STEP_NAMES.index(step), getattr(self, STEP_METHODS[step]), () if mask.all() else (mask,)))
+            plan.append(position_plan)
+        return plan
+
+    ### Complete Monthly Step Check Functions (vectorized over scenarios)
+
+    def mature_accounts(self):
+        """Grow every debt and investment by one month at its fixed interest rate."""
+        for group in self.account_groups:
+            group.mature_one_month()
+
+    @property
+    def account_balances(self):
+        """(n_scenarios, n_accounts) balances in the column order of the "Accounts" table."""
+        return np.concatenate([group.balances for group in self.account_groups], axis=1)
+
+    def get_non_decision_determined_updates(self):
+        """Step -1: Do things that occur regardless of decisions."""
+        self.mature_accounts()
+        self.current_month_leftover_net_income += self.monthly_net_income_pre_deductions
+        self.years_past += 1/12
+        self.matching_amounts_left = self.matching_amounts.copy()
+        self.spent_401 = np.zeros(self.n_scenarios)
+        self.spent_IRA = np.zeros(self.n_scenarios)
+        self.employer_flat_rate_investments.balances += self.flat_rate_amounts
+
+    def get_monthly_spend_on_needs(self):
+        """Step 0: Spend money on determined needs."""
+        self.current_month_leftover_net_income -= self.total_need_spend
+
+    def get_monthly_emergency_fund_expendature(self, mask = None):
+        """Step 1: Build Emergency Fund of emergency_fund_months (only for scenarios in mask)."""
+        leftover = self.current_month_leftover_net_income
+        short_term_savings_total = self.short_term_investments.balances.sum(axis=1)
+        need = self.monthly_need_expendature
+        months, high_interest_rate = self.emergency_fund_months, self.high_interest_rate
+        # Usual Case
+        needed = np.where(short_term_savings_total >= need*months, 0.0, np.minimum(leftover, need*months - short_term_savings_total))
+        # High Interest Dept Exception Case
+        needed = np.where((self.highest_interest_debt >= high_interest_rate) & (short_term_savings_total >= need), 0.0, needed)
+        needed = np.where((short_term_savings_total < need) & (self.highest_interest_debt > high_interest_rate),
+                          np.minimum(leftover, need - short_term_savings_total), needed)
+        if mask is not None:
+            needed = np.where(mask, needed, 0.0)
+        self.current_month_leftover_net_income = leftover - needed
+        self.short_term_investments.contribute_evenly(needed)
+        return needed
+
+    def get_monthly_contribution_to_employer_matching(self, mask = None):
+        """Step 2: Contribute to employer matching funds (only for scenarios in mask)."""
+        group = self.employer_matched_investments
+        contributions = np.zeros_like(group.balances)
+        for index in group.ranked:
+            feasible = np.minimum(self.current_month_leftover_net_income, self.matching_amounts_left[index])
+            if mask is not None:
+                feasible = np.where(mask, feasible, 0.0)
+            group.balances[index] += feasible*2 # Multiply by two for matching
+            self.current_month_leftover_net_income -= feasible
+            self.matching_amounts_left[index] -= feasible
+            contributions[index] = feasible
+            self.spent_401 += feasible
+        return contributions
+
+    def pay_off_high_interest_debt(self, mask = None):
+        """Step 3: Pay off high interest debt (only for scenarios in mask)."""
+        group = self.debts
+        payments = np.zeros_like(group.balances)
+        possible_contributed = np.minimum(self.maximum_monthly_loan_payment, self.current_month_leftover_net_income)
+        if mask is not None:
+            possible_contributed = np.where(mask, possible_contributed, 0.0)
+        for index in group.ranked:
+            feasible = np.minimum(possible_contributed, group.balances[index])
+            possible_contributed -= feasible
+            group.balances[index] -= feasible
+            self.current_month_leftover_net_income -= feasible
+            payments[index] = feasible
+        return payments
+
+    def get_IRA_contribution(self, mask = None):
+        """Step 4: Contribute to IRA evenly across IRAs (only for scenarios in mask)."""
+        group = self.other_ira_investments
+        contributions = np.zeros_like(group.balances)
+        if group.size == 0:
+            raise ZeroDivisionError("Need at least one IRA to split the IRA contribution over.")
+        per_account = self.ira_yearly_limit / group.size / 12
+        for index in group.ranked:
+            feasible = np.minimum(self.current_month_leftover_net_income, per_account)
+            if mask is not None:
+                feasible = np.where(mask, feasible, 0.0)
+            group.balances[index] += feasible
+            self.current_month_leftover_net_income -= feasible
+            contributions[index] = feasible
+            self.spent_IRA += feasible
+        return contributions
+
+    def allocate_savings_and_leisure_funds(self):
+        """Step 5: Excess 401K, excess IRA, then split the rest between savings and leisure."""
+        leftover = self.current_month_leftover_net_income
+        self.current_month_leftover_net_income = np.zeros(self.n_scenarios)
+        # Contribute excess 401K
+        leftover_401_possible = self.max_401K_legal - self.spent_401
+        excess_401 = np.where(leftover >= leftover_401_possible, leftover_401_possible, leftover)
+        leftover = np.where(leftover >= leftover_401_possible, leftover - leftover_401_possible, 0.0)
+        self.employer_matched_investments.balances[self.excess_401_index] += excess_401
+        # Contribute excess IRA
+        leftover_IRA_possible = self.max_IRA_legal - self.spent_IRA
+        excess_IRA = np.where(leftover >= leftover_IRA_possible, leftover_IRA_possible, leftover)
+        leftover = np.where(leftover >= leftover_IRA_possible, leftover - leftover_IRA_possible, 0.0)
+        self.other_ira_investments.balances[self.excess_IRA_index] += excess_IRA
+        # Leftover split savings and leisure
+        excess_savings = leftover*self.savings_leftover_percent
+        self.short_term_investments.contribute_evenly(excess_savings)
+        return dict({"Excess 401K" : excess_401,
+                     "Excess IRA" : excess_IRA,
+                     "Excess Savings" : excess_savings,
+                     "Excess Leisure" : leftover*self.leisure_leftover_percent})
+
+    def advance_one_month(self):
+        """One month of the waterfall for every scenario, recorded into the batch recorder unless record is off."""
+        years_past = self.years_past.copy()
+        self.get_non_decision_determined_updates()
+        # Steps 0-5 in the order of each scenario's allocation policy, summing a step split over positions
+        outputs = [None]*len(STEP_NAMES)
+        for position_plan in self.plan:
+            for step, method, arguments in position_plan:
+                output = method(*arguments)
+                outputs[step] = output if outputs[step] is None else outputs[step] + output
+        step_0, step_1, step_2, step_3, step_4, step_5 = outputs
+        # Recalculate with pre-tax deductions and distribute leftover to savings and leisure (50% split by default)
+        deductions_spent_total = step_2.sum(axis=1) + step_4.sum(axis=1) + step_5["Excess 401K"] + step_5["Excess IRA"]
+        month_net_income_post_deductions = self.tax_schedule.net_income_array(gross_income = self.gross_income,
+                                                                              additional_deductions = deductions_spent_total*12)/12
+        leftover_to_distribute = month_net_income_post_deductions - self.monthly_net_income_pre_deductions
+        post_deduction_savings = leftover_to_distribute*self.post_deduction_savings_share
+        self.short_term_investments.contribute_evenly(post_deduction_savings)
+        if self.record:
+            self.record_month(years_past, step_1, step_2, step_3, step_4, step_5, post_deduction_savings,
+                              leftover_to_distribute*(1 - self.post_deduction_savings_share))
+
+    def record_month(self, years_past, step_1, step_2, step_3, step_4, step_5, post_deduction_savings, post_deduction_leisure):
+        """Write one month of every scenario into the recorder."""
+        if self.recorder is None:
+            self.recorder = MonthlyRecorder(self.layout, width=self.n_scenarios)
+        recorder = self.recorder
+        recorder.reserve(1)
+        recorder.write("Spent", "Years", years_past)
+        recorder.write_dict("Spent", dict(zip(self.employer_matched_investments.types, step_2.T)))
+        recorder.write_dict("Spent", dict(zip(self.other_ira_investments.types, step_4.T)))
+        recorder.write_dict("Spent", self.need_spend)
+        recorder.write_dict("Spent", dict(zip(self.debts.types, step_3.T)))
+        recorder.write_dict("Spent", step_5)
+        recorder.write("Spent", "Emergency Fund", step_1)
+        recorder.write("Spent", "Post-Deduction Savings", post_deduction_savings)
+        recorder.write("Spent", "Post-Deduction Leisure", post_deduction_leisure)
+        recorder.write("Accounts", "Years", self.years_past)
+        for group in self.account_groups:
+            recorder.write_dict("Accounts", dict(zip(group.types, group.balances.T)))
+        recorder.next_row()
+
+    def simulate_n_years(self, years):
+        months = years*12
+        if self.record:
+            if self.recorder is None:
+                self.recorder = MonthlyRecorder(self.layout, capacity=months, width=self.n_scenarios)
+            self.recorder.reserve(months)
+        for month in range(months):
+            self.advance_one_month()
+        return self.results if self.record else None
+
+    @property
+    def paycheck_only_spending_columns(self) -> list:
+        deduction_columns = set(self.employer_matched_investments.types + self.other_ira_investments.types + ["Excess 401K", "Excess IRA"])
+        return [column for column in self.layout["Spent"] if column not in deduction_columns]
+
+    def derived_tables(self, spent : pl.LazyFrame, accounts : pl.LazyFrame) -> ResultTables:
+        return derived_tables(spent, accounts, self.paycheck_only_spending_columns, self.employer_matched_investments.types,
+                              self.other_ira_investments.types, self.debts.types, list(self.need_spend))
+
+    @property
+    def results(self) -> ResultTables:
+        """Output tables of every scenario stacked behind a "Scenario" column."""
+        return self.derived_tables(self.recorder.scan("Spent"), self.recorder.scan("Accounts"))
+
+    def scenario_results(self, scenario) -> ResultTables:
+        """Output tables of one scenario, in the same shape as FinancialProfile.simulate_n_years."""
+        return self.derived_tables(self.recorder.scenario_frame("Spent", scenario).lazy(),
+                                   self.recorder.scenario_frame("Accounts", scenario).lazy())
@@ -0,0 +1,207 @@
+"""Benchmarks of the monthly simulation hot path.
+
+python benchmark.py run --output benchmark.json        Time everything and write the results as JSON
+python benchmark.py run --quick --output quick.json    Smaller axes, for a fast check
+python benchmark.py compare baseline.json benchmark.json --tolerance 0.1
+                                                       Flag benchmarks that got slower or use more memory
+
+Simulations start from the selections.py profile, scaled up with extra accounts or jobs along each axis."""
+import argparse
+import copy
+import datetime
+import itertools
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+from helper_functions import calculate_net_income, TaxSchedule
+
+federal_tax_brackets = [
+    (11600, 0.10),
+    (47150, 0.12),
+    (100525, 0.22),
+    (191950, 0.24),
+    (243725, 0.32),
+    (609350, 0.35),
+    (float('inf'), 0.37)
+] # Same brackets as selections.py
+
+def best_time(function, repeats=3):
+    """Best wall time of a few runs (seconds)."""
+    times = []
+    for repeat in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def peak_memory(function):
+    """Peak traced memory (bytes) allocated while running function once."""
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def benchmark_tax_engine(sizes=(1, 1000, 1000000), seed=0):
+    """Compare calculate_net_income in a Python loop against TaxSchedule (vectorized and memoized) per number of incomes."""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for size in sizes:
+        gross_incomes = rng.uniform(20000, 500000, size)
+        deductions = rng.uniform(0, 30000, size)
+        tax_schedule = TaxSchedule(federal_tax_brackets, standard_deduction=14600, state_tax_rate=0.0475, fica_rate=0.0765)
+        loop = lambda: [calculate_net_income(gross, 14600, federal_tax_brackets, 0.0475, 0.0765, deduction)
+                        for gross, deduction in zip(gross_incomes, deductions)]
+        vectorized = lambda: tax_schedule.net_income_array(gross_incomes, deductions)
+        # Repeated scalar calls for the same income, as FinancialProfile does every month
+        repeated_gross, repeated_deduction = gross_incomes[0], deductions[0]
+        memoized = lambda: [tax_schedule.net_income(repeated_gross, repeated_deduction) for call in range(size)]
+        rows.append(dict({"Incomes" : size,
+                          "Loop (s)" : best_time(loop, repeats=1 if size >= 100000 else 3),
+                          "Vectorized (s)" : best_time(vectorized),
+                          "Memoized repeat (s)" : best_time(memoized, repeats=1 if size >= 100000 else 3)}))
+    return rows
+
+### Simulation benchmarks
+
+def selections_spec() -> dict:
+    """Spec of the selections.py profile at its initial balances."""
+    from profile_spec import profile_to_spec
+    import selections
+    profile = selections.profile.fork(selections.profile.initial_snapshot)
+    return profile_to_spec(profile)
+
+def count_accounts(spec : dict) -> int:
+    return len(spec["debts"]) + sum(len(category_dict) for category_dict in spec["investments"].values())
+
+def scaled_spec(spec : dict, n_accounts = None, n_jobs = None) -> dict:
+    """Copy of a spec grown to n_accounts debts and investments (alternating extra debts and "Other" investments)
+    and n_jobs jobs (extra part time jobs without benefits). Counts below the spec's own are left as they are."""
+    spec = copy.deepcopy(spec)
+    for extra in range(max(0, (n_accounts or 0) - count_accounts(spec))):
+        if extra % 2 == 0:
+            spec["debts"][f"Debt {extra}"] = dict({"initial_outstanding_balance" : 1000.0 + 10*extra,
+                                                   "interest_rate" : 0.03 + 0.0001*extra, "compounding" : "monthly",
+                                                   "type" : f"Debt {extra}"})
+        else:
+            spec["investments"]["Other"][f"Fund {extra}"] = dict({"initial_outstanding_balance" : 500.0 + 10*extra,
+                                                                  "interest_rate" : 0.04 + 0.0001*extra, "compounding" : "annually",
+                                                                  "type" : f"Fund {extra}"})
+    for extra in range(max(0, (n_jobs or 0) - len(spec["employer_benefits"]))):
+        spec["employer_benefits"][f"Job {extra}"] = dict({"salary" : 5000.0, "retirement_matching" : dict(),
+                                                          "monthly_flat_rate_contributions" : dict(), "company_insurances" : []})
+    return spec
+
+def benchmark_simulation(spec : dict, years : int, repeats = 3) -> dict:
+    """Months per second and peak memory of simulate_n_years on fresh profiles built from a spec."""
+    from profile_spec import profile_from_spec
+    profiles = [profile_from_spec(spec) for repeat in range(repeats + 1)]
+    seconds = min(best_time(lambda: profile.simulate_n_years(years), repeats=1) for profile in profiles[:repeats])
+    return dict({"seconds" : seconds,
+                 "months_per_second" : years*12 / seconds,
+                 "peak_memory_bytes" : peak_memory(lambda: profiles[-1].simulate_n_years(years))})
+
+def policy_variants() -> list:
+    """Every order of the steps between needs and leftover, as allocation policy specs."""
+    return [dict({"steps" : ["needs", *order, "leftover"]}) for order in itertools.permutations(["emergency_fund", "matching", "debts", "ira"])]
+
+def benchmark_batch(spec : dict, years : int, n_scenarios : int, repeats = 3, policies = None) -> dict:
+    """Scenario months per second and peak memory of FinancialProfileBatch.simulate_n_years.
+
+    policies: allocation policy specs the scenarios take turns with, all use the spec's own by default."""
+    from batch import FinancialProfileBatch
+    from profile_spec import profile_from_spec
+    if policies is None:
+        profiles = [profile_from_spec(spec)]*n_scenarios
+    else:
+        variants = [profile_from_spec(dict(spec, allocation_policy=policy)) for policy in policies]
+        profiles = [variants[scenario % len(variants)] for scenario in range(n_scenarios)]
+    seconds = best_time(lambda: FinancialProfileBatch(profiles).simulate_n_years(years), repeats=repeats)
+    return dict({"seconds" : seconds,
+                 "months_per_second" : n_scenarios*years*12 / seconds,
+                 "peak_memory_bytes" : peak_memory(lambda: FinancialProfileBatch(profiles).simulate_n_years(years))})
+
+def run_suite(quick = False) -> dict:
+    """Every benchmark as {"environment" : ..., "results" : [{"benchmark", "params", measurements...}]}."""
+    spec = selections_spec()
+    horizons = (1, 10, 50) if quick else (1, 10, 25, 50, 100)
+    account_counts = (10, 50) if quick else (10, 25, 50, 100, 200)
+    job_counts = (1, 5) if quick else (1, 2, 5, 10, 20)
+    scenario_counts = (1, 100) if quick else (1, 10, 100, 1000)
+    tax_sizes = (1, 1000) if quick else (1, 1000, 1000000)
+    results = []
+    add = lambda benchmark, params, measurements: results.append(dict({"benchmark" : benchmark, "params" : params}, **measurements))
+    add("selections", dict({"years" : 50}), benchmark_simulation(spec, 50))
+    for years in horizons:
+        add("horizon", dict({"years" : years}), benchmark_simulation(spec, years))
+    for n_accounts in account_counts:
+        add("accounts", dict({"years" : 10, "accounts" : max(n_accounts, count_accounts(spec))}),
+            benchmark_simulation(scaled_spec(spec, n_accounts=n_accounts), 10))
+    for n_jobs in job_counts:
+        add("jobs", dict({"years" : 10, "jobs" : n_jobs}), benchmark_simulation(scaled_spec(spec, n_jobs=n_jobs), 10))
+    for n_scenarios in scenario_counts:
+        add("batch scenarios", dict({"years" : 10, "scenarios" : n_scenarios}), benchmark_batch(spec, 10, n_scenarios))
+    for n_scenarios in scenario_counts[1:]:
+        add("batch policies", dict({"years" : 10, "scenarios" : n_scenarios, "policies" : len(policy_variants())}),
+            benchmark_batch(spec, 10, n_scenarios, policies=policy_variants()))
+    for row in benchmark_tax_engine(sizes=tax_sizes):
+        for method in ["Loop", "Vectorized", "Memoized repeat"]:
+            add("net income", dict({"incomes" : row["Incomes"], "method" : method}), dict({"seconds" : row[f"{method} (s)"]}))
+    environment = dict({"python" : platform.python_version(), "numpy" : np.__version__, "platform" : platform.platform(),
+                        "date" : datetime.datetime.now().isoformat(timespec="seconds")})
+    return dict({"environment" : environment, "results" : results})
+
+def compare(baseline : dict, current : dict, tolerance = 0.1) -> list:
+    """Benchmarks of current that are more than tolerance (fraction) slower or bigger than in baseline.
+
+    Returns (benchmark, params, measurement, baseline value, current value) rows."""
+    key = lambda row: (row["benchmark"], json.dumps(row["params"], sort_keys=True))
+    baseline_rows = dict({key(row) : row for row in baseline["results"]})
+    regressions = []
+    for row in current["results"]:
+        old = baseline_rows.get(key(row))
+        if old is None:
+            continue
+        for measurement in ["seconds", "peak_memory_bytes"]:
+            if measurement in row and measurement in old and row[measurement] > old[measurement]*(1 + tolerance):
+                regressions.append((row["benchmark"], row["params"], measurement, old[measurement], row[measurement]))
+    return regressions
+
+def main(arguments = None):
+    parser = argparse.ArgumentParser(description="Benchmark the monthly simulation.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="Run the benchmark suite")
+    run.add_argument("--output", default="benchmark.json")
+    run.add_argument("--quick", action="store_true", help="Smaller scaling axes")
+    compare_command = commands.add_parser("compare", help="Flag regressions against a baseline")
+    compare_command.add_argument("baseline")
+    compare_command.add_argument("current")
+    compare_command.add_argument("--tolerance", type=float, default=0.1, help="Allowed slowdown/growth as a fraction")
+    arguments = parser.parse_args(arguments)
+
+    if arguments.command == "run":
+        suite = run_suite(quick=arguments.quick)
+        with open(arguments.output, "w") as file:
+            json.dump(suite, file, indent=1)
+        for row in suite["results"]:
+            rate = f", {row['months_per_second']:.0f} months/s" if "months_per_second" in row else ""
+            memory = f", {row['peak_memory_bytes']/1e6:.2f} MB peak" if "peak_memory_bytes" in row else ""
+            print(f"{row['benchmark']} {row['params']}: {row['seconds']:.3g} s{rate}{memory}")
+        return 0
+    with open(arguments.baseline) as file:
+        baseline = json.load(file)
+    with open(arguments.current) as file:
+        current = json.load(file)
+    regressions = compare(baseline, current, arguments.tolerance)
+    for benchmark, params, measurement, old, new in regressions:
+        print(f"REGRESSION {benchmark} {params} {measurement}: {old:.4g} -> {new:.4g} ({new/old - 1:+.0%})")
+    if len(regressions) == 0:
+        print("No regressions.")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
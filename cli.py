@@ -0,0 +1,80 @@
+"""Command line entry point.
+
+python cli.py validate examples/profile.toml
+python cli.py run examples/profile.toml --years 50 --output results
+python cli.py batch households.jsonl --years 50 --output households
+python cli.py export-selections profile.json
+
+Only the standard library is imported until a profile is actually simulated, so --help and validate start fast."""
+import argparse
+import sys
+
+def validate(arguments):
+    from profile_config import load_profile_spec
+    spec = load_profile_spec(arguments.profile)
+    n_investments = sum(len(category_dict) for category_dict in spec["investments"].values())
+    print(f"{arguments.profile} is valid: {len(spec['debts'])} debts, {n_investments} investments, "
+          f"{len(spec['employer_benefits'])} jobs, {len(spec['monthly_needs'])} needs.")
+
+def run(arguments):
+    from profile_config import load_profile
+    from sinks import ParquetSink, IPCSink, stream_to_sink
+    profile = load_profile(arguments.profile)
+    sink = (ParquetSink if arguments.format == "parquet" else IPCSink)(arguments.output)
+    chunks = stream_to_sink(profile, arguments.years, sink, chunk_months=arguments.chunk_months or arguments.years*12,
+                            fast_forward=arguments.fast_forward)
+    print(f"Wrote {arguments.years} years in {chunks} chunks to {arguments.output}, read them with sinks.scan_results.")
+
+def batch(arguments):
+    from households import run_households
+    summary = run_households(arguments.households, arguments.output, arguments.years, n_workers=arguments.workers,
+                             fast_forward=arguments.fast_forward, long_format=arguments.long, float32=arguments.float32)
+    print(f"{summary['completed']} households done ({summary['skipped']} already done, {summary['failed']} failed, see "
+          f"_failed.jsonl) in {summary['seconds']:.1f} s, {summary['households_per_second']:.1f} households/s.")
+
+def export_selections(arguments):
+    from profile_config import write_profile_file
+    from profile_spec import profile_to_spec
+    import selections
+    write_profile_file(profile_to_spec(selections.profile), arguments.output)
+    print(f"Wrote the selections.py profile to {arguments.output}.")
+
+def main(arguments = None):
+    parser = argparse.ArgumentParser(description="Simulate monthly budgets of a financial profile.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    validate_command = commands.add_parser("validate", help="Check a .toml or .json profile file")
+    validate_command.add_argument("profile")
+    validate_command.set_defaults(function=validate)
+    run_command = commands.add_parser("run", help="Simulate a profile file and write the output tables")
+    run_command.add_argument("profile")
+    run_command.add_argument("--years", type=int, default=50)
+    run_command.add_argument("--output", default="results", help="Directory for the output tables")
+    run_command.add_argument("--format", choices=["parquet", "arrow"], default="parquet")
+    run_command.add_argument("--chunk-months", type=int, default=None, help="Write every this many months (default: all at once)")
+    run_command.add_argument("--fast-forward", action="store_true", help="Skip steady stretches in closed form")
+    run_command.set_defaults(function=run)
+    batch_command = commands.add_parser("batch", help="Simulate every household of a .jsonl or .parquet file, resuming where a previous run stopped")
+    batch_command.add_argument("households")
+    batch_command.add_argument("--years", type=int, default=50)
+    batch_command.add_argument("--output", default="households", help="Directory with one household_id=<id> partition per household")
+    batch_command.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    batch_command.add_argument("--fast-forward", action="store_true", help="Skip steady stretches in closed form")
+    batch_command.add_argument("--long", action="store_true", help="Write one long table (scenario_id, month, account, kind, amount) per household")
+    batch_command.add_argument("--float32", action="store_true", help="Store long table amounts as float32")
+    batch_command.set_defaults(function=batch)
+    export_command = commands.add_parser("export-selections", help="Write the selections.py profile as a JSON profile file")
+    export_command.add_argument("output")
+    export_command.set_defaults(function=export_selections)
+    arguments = parser.parse_args(arguments)
+    try:
+        arguments.function(arguments)
+    except (ValueError, OSError) as error:
+        print(error, file=sys.stderr)
+        return 1
+    except Exception as error: # Anything the simulation itself runs into
+        print(f"Simulation failed: {type(error).__name__}: {error}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+"""Inverse questions: the threshold of one profile spec parameter at which a goal is just reached.
+
+i.e. the minimum salary for a 401K balance by year 20, or the smallest maximum_monthly_loan_payment that is debt free
+by year 10. Candidates are simulated only until the goal is provably met or missed, and several candidates are
+stepped together as a FinancialProfileBatch when batch_size > 1."""
+import numpy as np
+from batch import FinancialProfileBatch
+from objects import Debt
+from profile_spec import profile_from_spec, set_spec_value
+
+class BalanceGoal:
+    """Balance of an investment (by type, i.e. "401K") of at least target at the end of a year.
+
+    Reaching the target early only counts as met when the balance can not fall afterwards: the investment does not
+    shrink and the income covers the needs (otherwise the shortfall comes out of the contributions). Specs have no
+    scheduled events, so income, needs and rates stay the same for the whole run."""
+
+    def __init__(self, account : str, target : float, year : int):
+        self.account = account
+        self.target = target
+        self.months = year*12
+
+    def decide(self, state : dict, months_left : int):
+        """(met, missed) arrays per scenario, both False while it is still open."""
+        balance, growth = state["balances"][self.account], state["growth"][self.account]
+        # Balances only fall at negative rates or when the needs eat into the contributions, otherwise reaching the target early is enough
+        met = (balance >= self.target) & (((growth >= 1) & state["covers_needs"]) | (months_left == 0))
+        # Even contributing the most a month could ever bring in does not reach the target
+        highest = Debt.annuity_balance(balance, growth, -state["contribution_bound"], months_left)
+        return met, ~met & (highest < self.target)
+
+    def __repr__(self):
+        return f"{self.account} of at least {self.target} by month {self.months}"
+
+class DebtFreeGoal:
+    """Every debt paid off by the end of a year."""
+
+    def __init__(self, year : int):
+        self.months = year*12
+
+    def decide(self, state : dict, months_left : int):
+        debt_balances = np.array([state["balances"][debt_type] for debt_type in state["debt_types"]]).reshape(-1, len(state["contribution_bound"]))
+        debt_growth = np.array([state["growth"][debt_type] for debt_type in state["debt_types"]]).reshape(debt_balances.shape)
+        met = (debt_balances <= 0).all(axis=0)
+        # Even the full maximum_monthly_loan_payment on one debt alone takes longer than is left
+        fastest, last_payment = Debt.annuity_payoff(debt_balances, debt_growth, state["payments"])
+        return met, ~met & (fastest.max(axis=0, initial=0) > months_left)
+
+    def __repr__(self):
+        return f"debt free by month {self.months}"
+
+def contribution_bound(profile) -> float:
+    """Most a single account can receive in a month: twice the gross income (employee matching counts double) plus
+    every flat rate contribution."""
+    flat_rate = sum(sum(job.monthly_flat_rate_contributions.values()) for job in profile.employer_benefits.values())
+    return 2*sum(job.monthly_gross for job in profile.employer_benefits.values()) + flat_rate
+
+def profile_state(profile) -> dict:
+    """Arrays (of one scenario) the goals are decided on."""
+    growth = profile.ledger.growth[profile.account_slots]
+    return dict({"balances" : dict({account_type : np.array([balance]) for account_type, balance in profile.all_balances_dict.items()}),
+                 "growth" : dict({account_type : np.array([value]) for account_type, value in zip(profile.account_types, growth)}),
+                 "debt_types" : [debt.type for debt in profile.debts],
+                 "payments" : np.array([profile.maximum_monthly_loan_payment]),
+                 "covers_needs" : np.array([profile.monthly_net_income(additional_deductions=0) >= profile.month_constants["Total Need Spend"]]),
+                 "contribution_bound" : np.array([contribution_bound(profile)])})
+
+def batch_state(batch : FinancialProfileBatch, profiles : list) -> dict:
+    groups = batch.account_groups
+    return dict({"balances" : dict({account_type : group.balances[:, column] for group in groups for column, account_type in enumerate(group.types)}),
+                 "growth" : dict({account_type : group.growth[:, column] for group in groups for column, account_type in enumerate(group.types)}),
+                 "debt_types" : batch.debts.types,
+                 "payments" : batch.maximum_monthly_loan_payment,
+                 "covers_needs" : batch.monthly_net_income_pre_deductions >= batch.total_need_spend,
+                 "contribution_bound" : np.array([contribution_bound(profile) for profile in profiles])})
+
+def evaluate_goal(specs : list[dict], goal, batched = True, fast_forward = True):
+    """Whether each spec meets the goal, and the months simulated for all of them together.
+
+    Each simulation stops as soon as its goal is decided. Batched specs are stepped together until all are decided,
+    specs that can not be batched (different accounts) run one by one, fast forwarding steady stretches."""
+    profiles = [profile_from_spec(spec) for spec in specs]
+    if any(len(profile.timeline) > 0 for profile in profiles):
+        raise ValueError("Goals can only be decided early for profiles without scheduled events.")
+    if batched and len(profiles) > 1:
+        try:
+            batch = FinancialProfileBatch(profiles)
+        except ValueError:
+            batch = None
+        if batch is not None:
+            batch.record = False
+            decided = np.zeros(len(profiles), dtype=bool)
+            met = np.zeros(len(profiles), dtype=bool)
+            for month in range(goal.months + 1):
+                now_met, now_missed = goal.decide(batch_state(batch, profiles), goal.months - month)
+                met |= now_met & ~decided
+                decided |= now_met | now_missed
+                if decided.all():
+                    break
+                batch.advance_one_month()
+            return met, month*len(profiles)
+    met, simulated_months = np.zeros(len(profiles), dtype=bool), 0
+    for index, profile in enumerate(profiles):
+        month = 0
+        steps = profile._advance_months(goal.months, fast_forward=fast_forward)
+        while True:
+            now_met, now_missed = goal.decide(profile_state(profile), goal.months - month)
+            if now_met[0] or now_missed[0]:
+                met[index] = now_met[0]
+                break
+            month+=next(steps)
+        simulated_months+=month
+    return met, simulated_months
+
+def solve(spec : dict, parameter : str, goal, low : float, high : float, tolerance = None, batch_size = 1,
+          fast_forward = True) -> dict:
+    """Threshold of a spec parameter (dot separated path, see profile_spec.set_spec_value) where the goal flips
+    between missed and met, bracketed between low and high.
+
+    The goal must be met at only one end of the range. batch_size candidates are evaluated per round (bisection for 1),
+    shrinking the bracket batch_size + 1 times, until it is narrower than tolerance (1/10000 of the range by default).
+    Returns the value (the met end of the final bracket), the bracket, evaluations and the months simulated."""
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1.")
+    tolerance = abs(high - low)*1e-4 if tolerance is None else tolerance
+    with_value = lambda value: set_spec_value(spec, parameter, value)
+    (met_low, met_high), simulated_months = evaluate_goal([with_value(low), with_value(high)], goal, fast_forward=fast_forward)
+    evaluations = 2
+    if met_low == met_high:
+        raise ValueError(f"{goal} is {'met' if met_low else 'missed'} for every {parameter} from {low} to {high}.")
+    missed_end, met_end = (high, low) if met_low else (low, high)
+    while abs(met_end - missed_end) > tolerance:
+        candidates = [missed_end + (met_end - missed_end)*step/(batch_size + 1) for step in range(1, batch_size + 1)]
+        met, months = evaluate_goal([with_value(candidate) for candidate in candidates], goal, fast_forward=fast_forward)
+        evaluations+=len(candidates)
+        simulated_months+=months
+        first_met = int(np.argmax(met)) if met.any() else len(candidates)
+        if first_met < len(candidates):
+            met_end = candidates[first_met]
+        if first_met > 0:
+            missed_end = candidates[first_met - 1]
+    return dict({"value" : met_end, "bracket" : tuple(sorted([missed_end, met_end])), "evaluations" : evaluations,
+                 "simulated_months" : simulated_months, "full_months" : evaluations*goal.months})
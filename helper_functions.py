@@ -1,3 +1,6 @@
+import numpy as np
+from collections import OrderedDict
+
 def calculate_net_income(gross_income, standard_deduction, federal_tax_brackets, state_tax_rate, fica_rate,
                          additional_deductions=0):
     """
@@ -34,6 +37,83 @@ def calculate_net_income(gross_income, standard_deduction, federal_tax_brackets,
 
     return net_income
 
+class TaxSchedule:
+    """
+    Compiled version of calculate_net_income for one set of tax parameters.
+
+    Cumulative bracket thresholds and the federal tax owed at each threshold are computed once, so a whole array
+    of incomes is taxed with a single np.searchsorted. Scalar results are memoized in a bounded LRU cache and are
+    identical to calculate_net_income.
+
+    :param federal_tax_brackets: Same (bracket width, rate) list as calculate_net_income.
+    :param standard_deduction, state_tax_rate, fica_rate: Scalars, or arrays (one per income) for net_income_array.
+    :param cache_size: Number of (gross income, deductions) results kept by net_income.
+    """
+
+    def __init__(self, federal_tax_brackets, standard_deduction, state_tax_rate, fica_rate, cache_size=1024):
+        self.federal_tax_brackets = list(federal_tax_brackets)
+        self.standard_deduction = standard_deduction
+        self.state_tax_rate = state_tax_rate
+        self.fica_rate = fica_rate
+        # Bracket k covers taxable incomes in (lower_thresholds[k], upper_thresholds[k]]
+        lower_thresholds, tax_at_threshold = [0.0], [0.0]
+        for bracket_width, bracket_rate in self.federal_tax_brackets:
+            lower_thresholds.append(lower_thresholds[-1] + bracket_width)
+            tax_at_threshold.append(tax_at_threshold[-1] + bracket_width * bracket_rate)
+        self.upper_thresholds = np.array(lower_thresholds[1:], dtype=np.float64)
+        self.lower_thresholds = np.array(lower_thresholds, dtype=np.float64)
+        self.tax_at_threshold = np.array(tax_at_threshold, dtype=np.float64)
+        self.rates = np.array([bracket_rate for bracket_width, bracket_rate in self.federal_tax_brackets] + [0.0], dtype=np.float64)
+        # Income past the last (finite) bracket is not taxed, like calculate_net_income
+        self.lower_thresholds[-1] = 0.0
+        # Subtracting whole-dollar thresholds at once matches the bracket by bracket subtraction exactly
+        self.exact = all(float(bracket_width).is_integer() or bracket_width == float('inf')
+                         for bracket_width, bracket_rate in self.federal_tax_brackets)
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def federal_tax(self, taxable_income):
+        """Federal tax on an array of (positive) taxable incomes."""
+        bracket_index = np.searchsorted(self.upper_thresholds, taxable_income, side="left")
+        return self.tax_at_threshold[bracket_index] + \
+            (taxable_income - self.lower_thresholds[bracket_index]) * self.rates[bracket_index]
+
+    def net_income_array(self, gross_income, additional_deductions=0):
+        """Net incomes for an array of gross incomes and deductions in one call."""
+        gross_income = np.asarray(gross_income, dtype=np.float64)
+        taxable_income = gross_income - self.standard_deduction - additional_deductions
+        federal_tax = self.federal_tax(np.maximum(taxable_income, 0.0))
+        net_income = gross_income - (federal_tax + gross_income * self.state_tax_rate + gross_income * self.fica_rate)
+        # If deduction is more than gross income, no tax
+        return np.where(taxable_income <= 0, gross_income, net_income)
+
+    def net_income(self, gross_income, additional_deductions=0):
+        """Net income of a single gross income, memoized on (gross income, deductions)."""
+        key = (gross_income, additional_deductions)
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        self.misses += 1
+        taxable_income = gross_income - self.standard_deduction - additional_deductions
+        if taxable_income <= 0:
+            net_income = gross_income
+        elif not self.exact:
+            net_income = calculate_net_income(gross_income, self.standard_deduction, self.federal_tax_brackets,
+                                              self.state_tax_rate, self.fica_rate, additional_deductions)
+        else:
+            bracket_index = int(np.searchsorted(self.upper_thresholds, taxable_income, side="left"))
+            federal_tax = float(self.tax_at_threshold[bracket_index])
+            if bracket_index < len(self.federal_tax_brackets):
+                federal_tax += (taxable_income - float(self.lower_thresholds[bracket_index])) * self.federal_tax_brackets[bracket_index][1]
+            net_income = gross_income - (federal_tax + gross_income * self.state_tax_rate + gross_income * self.fica_rate)
+        self.cache[key] = net_income
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return net_income
+
 def flatten_investment_dict(nested_dict):
     """Flatten a nested dictionary to a single level with concatenated keys."""
     all_keys = []
@@ -44,4 +124,10 @@ def flatten_investment_dict(nested_dict):
                 raise ValueError("There is more than one investment type with the same name.")
             all_keys.append(k2)
             ret_dict.update({k2 : v2})
-    return ret_dict
\ No newline at end of file
+    return ret_dict
+
+def column_dtype(value):
+    """Numpy dtype a recorded value keeps in the output tables (integers stay integers, everything else is float)."""
+    if isinstance(value, (int, np.integer)) and not isinstance(value, bool):
+        return np.int64
+    return np.float64
@@ -0,0 +1,141 @@
+"""Run a whole portfolio of households from a local file.
+
+Input is JSONL (one {"household_id" : ..., "profile" : spec} object per line) or Parquet (a household_id column and
+a profile column holding the spec as a JSON string), specs as in profile_config.py. Every household is written to its
+own partition, output/household_id=<id>/<table>.parquet, read them all back with scan_households."""
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+def read_households(path : str, batch_size = 1000):
+    """Lazily yield (household_id, spec) pairs from a .jsonl or .parquet file."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".jsonl":
+        with open(path) as file:
+            for line_number, line in enumerate(file, start=1):
+                if line.strip():
+                    row = json.loads(line)
+                    if "household_id" not in row or "profile" not in row:
+                        raise ValueError(f"Line {line_number} of {path} needs household_id and profile.")
+                    yield str(row["household_id"]), row["profile"]
+    elif extension == ".parquet":
+        import polars as pl
+        households = pl.scan_parquet(path).select(pl.col("household_id").cast(pl.String), "profile")
+        for offset in itertools.count(0, batch_size):
+            batch = households.slice(offset, batch_size).collect()
+            for household_id, profile in batch.iter_rows():
+                yield household_id, json.loads(profile)
+            if batch.height < batch_size:
+                return
+    else:
+        raise ValueError(f"Unknown households file type {extension}, use .jsonl or .parquet.")
+
+def partition_path(output : str, household_id : str) -> str:
+    if household_id in ["", ".", ".."] or "/" in household_id or os.sep in household_id:
+        raise ValueError(f"Household id {household_id!r} can not be used as a directory name.")
+    return os.path.join(output, f"household_id={household_id}")
+
+def run_household(household_id : str, spec : dict, output : str, years : int, fast_forward = False, long_format = False,
+                  float32 = False) -> str:
+    """Worker task: build, simulate and write one household. Returns None, or the error of an invalid household.
+
+    Tables are written to a temporary directory that is renamed into place, so a partition is either complete or absent.
+    With long_format only a single "Long" table is written (see objects.long_results), the same schema for every household."""
+    from profile_config import validate_spec
+    from profile_spec import profile_from_spec
+    partition = partition_path(output, household_id)
+    try:
+        results = profile_from_spec(validate_spec(spec)).simulate_n_years(years, fast_forward=fast_forward)
+        if long_format:
+            results = dict({"Long" : results.long(household_id, float32=float32).collect()})
+    except (ValueError, KeyError, TypeError, ZeroDivisionError) as error:
+        return f"{type(error).__name__}: {error}"
+    temporary = os.path.join(output, f"_tmp-{household_id}-{os.getpid()}")
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+    for table, frame in results.items():
+        frame.write_parquet(os.path.join(temporary, f"{table}.parquet"))
+    try:
+        os.rename(temporary, partition)
+    except OSError:
+        shutil.rmtree(temporary, ignore_errors=True)
+        return f"Household {household_id} is already written, is its id used twice?"
+    return None
+
+def run_households(path : str, output : str, years : int, n_workers = None, max_pending = None, fast_forward = False,
+                   report_every = 10.0, report = print, long_format = False, float32 = False) -> dict:
+    """Simulate every household of a file into output, in a process pool of n_workers (all cores by default).
+
+    At most max_pending (2 per worker by default) households are read ahead of the workers, so memory stays bounded
+    however big the file. Households whose partition already exists are skipped, so an interrupted run can simply be
+    started again (temporary directories an interrupted run left behind are removed first, so only one run may write
+    to an output at a time). Invalid households are listed in output/_failed.jsonl and retried on the next run. Progress is
+    passed to report every report_every seconds (None for no reports). Workers are spawned, so scripts calling this
+    need the usual if __name__ == "__main__": guard. long_format and float32 are passed to run_household.
+
+    Returns counts of completed, skipped and failed households, seconds and households_per_second."""
+    n_workers = n_workers or os.cpu_count()
+    max_pending = max_pending or 2*n_workers
+    os.makedirs(output, exist_ok=True)
+    for entry in os.listdir(output):
+        if entry.startswith("_tmp-"):
+            shutil.rmtree(os.path.join(output, entry), ignore_errors=True)
+    counts = dict({"completed" : 0, "skipped" : 0, "failed" : 0})
+    start = last_report = time.perf_counter()
+    failed = open(os.path.join(output, "_failed.jsonl"), "w")
+
+    def finish(household_id, error):
+        nonlocal last_report
+        if error is None:
+            counts["completed"]+=1
+        else:
+            counts["failed"]+=1
+            failed.write(json.dumps(dict({"household_id" : household_id, "error" : error})) + "\n")
+        if report is not None and report_every is not None and time.perf_counter() - last_report >= report_every:
+            last_report = time.perf_counter()
+            report(f"{counts['completed']} households done, {counts['skipped']} skipped, {counts['failed']} failed, "
+                   f"{counts['completed'] / (last_report - start):.1f} households/s")
+
+    def pending_households():
+        for household_id, spec in read_households(path):
+            try:
+                partition = partition_path(output, household_id)
+            except ValueError as error:
+                finish(household_id, str(error))
+                continue
+            if os.path.isdir(partition):
+                counts["skipped"]+=1
+            else:
+                yield household_id, spec
+
+    try:
+        if n_workers == 1:
+            for household_id, spec in pending_households():
+                finish(household_id, run_household(household_id, spec, output, years, fast_forward, long_format, float32))
+        else:
+            # Spawned, not forked: a forked child can deadlock in polars once the parent has used its thread pool
+            with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+                pending = dict()
+                for household_id, spec in pending_households():
+                    if len(pending) >= max_pending:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            finish(pending.pop(future), future.result())
+                    pending[executor.submit(run_household, household_id, spec, output, years, fast_forward, long_format, float32)] = household_id
+                for future in wait(pending).done:
+                    finish(pending.pop(future), future.result())
+    finally:
+        failed.close()
+    counts["seconds"] = time.perf_counter() - start
+    counts["households_per_second"] = counts["completed"] / counts["seconds"]
+    return counts
+
+def scan_households(output : str, table : str):
+    """LazyFrame of one output table of every household, with a household_id column."""
+    import polars as pl
+    return pl.scan_parquet(os.path.join(output, "household_id=*", f"{table}.parquet"), hive_partitioning=True,
+                           hive_schema=dict({"household_id" : pl.String}))
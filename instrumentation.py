@@ -0,0 +1,80 @@
+"""Opt-in timing of the monthly waterfall of a FinancialProfile (see FinancialProfile.instrument).
+
+While active, every step method of the profile is shadowed by a timing wrapper on the instance; on exit the
+wrappers are removed again, so an uninstrumented profile runs the plain methods with no overhead at all."""
+import time
+import polars as pl
+
+# Method : step name, in waterfall order
+STEPS = dict({"get_non_decision_determined_updates" : "Step -1: Non-Decision Updates",
+              "get_monthly_spend_on_needs" : "Step 0: Needs",
+              "get_monthly_emergency_fund_expendature" : "Step 1: Emergency Fund",
+              "get_monthly_contribution_to_employer_matching" : "Step 2: Employer Matching",
+              "pay_off_high_interest_debt" : "Step 3: Debt",
+              "get_IRA_contribution" : "Step 4: IRA",
+              "allocate_savings_and_leisure_funds" : "Step 5: Leftover Allocation",
+              "recalculate_net_income_with_deductions" : "Step 6: Tax Recalculation",
+              "record_month" : "Record",
+              "steady_state_months" : "Steady State Check",
+              "fast_forward" : "Fast Forward",
+              "advance_one_month" : "Month"})
+
+class StepInstrumentation:
+    """Cumulative wall time, calls and recorder allocations (column buffers and frames) per waterfall step.
+
+    hooks: callables hook(step name, seconds) run after every timed call."""
+
+    def __init__(self, hooks = ()):
+        self.hooks = list(hooks)
+        self.seconds = dict({step : 0.0 for step in STEPS.values()})
+        self.calls = dict({step : 0 for step in STEPS.values()})
+        self.allocations = dict({step : 0 for step in STEPS.values()})
+        self.profile = None
+
+    def attach(self, profile):
+        if profile.instrumentation is not None:
+            raise ValueError("Profile is already instrumented.")
+        for method, step in STEPS.items():
+            setattr(profile, method, self.timed(profile, getattr(profile, method), step))
+        profile.instrumentation = self
+        self.profile = profile
+
+    def detach(self, profile = None):
+        """Remove the wrappers (from a fork sharing them too when given)."""
+        profile = self.profile if profile is None else profile
+        for method in STEPS:
+            profile.__dict__.pop(method, None)
+        profile.instrumentation = None
+
+    def timed(self, profile, method, step):
+        def timed_method(*args, **kwargs):
+            allocations = 0 if profile.recorder is None else profile.recorder.allocations
+            start = time.perf_counter()
+            result = method(*args, **kwargs)
+            seconds = time.perf_counter() - start
+            self.seconds[step]+=seconds
+            self.calls[step]+=1
+            # A new recorder (first month) counts all its buffers
+            self.allocations[step]+=(0 if profile.recorder is None else profile.recorder.allocations) - allocations
+            for hook in self.hooks:
+                hook(step, seconds)
+            return result
+        return timed_method
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.detach()
+
+    def table(self) -> pl.DataFrame:
+        """One row per step with Calls, Seconds, Seconds per Call, Share of the stepped months' time and Allocations per Month."""
+        months = max(self.calls["Month"], 1)
+        month_seconds = self.seconds["Month"] or 1.0
+        steps = list(STEPS.values())
+        return pl.DataFrame(dict({"Step" : steps,
+                                  "Calls" : [self.calls[step] for step in steps],
+                                  "Seconds" : [self.seconds[step] for step in steps],
+                                  "Seconds per Call" : [self.seconds[step] / max(self.calls[step], 1) for step in steps],
+                                  "Share" : [self.seconds[step] / month_seconds for step in steps],
+                                  "Allocations per Month" : [self.allocations[step] / months for step in steps]}))
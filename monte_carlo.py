@@ -0,0 +1,169 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import polars as pl
+import numpy as np
+from batch import FinancialProfileBatch
+from objects import FinancialProfile
+
+class LognormalReturns:
+    """Correlated lognormal monthly returns for investment accounts.
+
+    volatilities: {investment type : annual volatility}, types left out keep their fixed interest rate.
+    correlation: correlation matrix ordered like volatilities (identity if None).
+    Each draw is a multiplicative shock with mean 1, so the expected growth of every account is its interest_rate."""
+
+    def __init__(self, volatilities : dict, correlation = None):
+        self.types = list(volatilities)
+        self.monthly_volatility = np.array([volatilities[fund_type] for fund_type in self.types], dtype=np.float64) / np.sqrt(12)
+        correlation = np.eye(len(self.types)) if correlation is None else np.asarray(correlation, dtype=np.float64)
+        if correlation.shape != (len(self.types), len(self.types)):
+            raise ValueError("Correlation matrix must be square with one row per volatility.")
+        if not np.allclose(correlation, correlation.T) or not np.allclose(np.diag(correlation), 1):
+            raise ValueError("Correlation matrix must be symmetric with a unit diagonal.")
+        try:
+            self.cholesky = np.linalg.cholesky(correlation)
+        except np.linalg.LinAlgError:
+            raise ValueError("Correlation matrix must be positive definite.")
+
+    def draw(self, rng, n_paths):
+        """(n_paths, n_types) growth shocks for one month."""
+        shocks = rng.standard_normal((n_paths, len(self.types))) @ self.cholesky.T
+        return np.exp(self.monthly_volatility*shocks - 0.5*self.monthly_volatility**2)
+
+class MonteCarloBatch(FinancialProfileBatch):
+    """FinancialProfileBatch where every scenario is one path of random investment returns (debts keep their fixed rate)."""
+
+    def __init__(self, profiles : list[FinancialProfile], return_model : LognormalReturns, rng):
+        super().__init__(profiles)
+        self.return_model = return_model
+        self.rng = rng
+        investment_groups = [self.short_term_investments, self.employer_matched_investments, self.employer_flat_rate_investments,
+                             self.other_ira_investments, self.other_investments]
+        self.stochastic_columns = []
+        for fund_type in return_model.types:
+            groups = [group for group in investment_groups if fund_type in group.types]
+            if len(groups) == 0:
+                raise ValueError(f"No investment of type {fund_type} to draw returns for.")
+            self.stochastic_columns.append((groups[0], groups[0].types.index(fund_type)))
+
+    def mature_accounts(self):
+        super().mature_accounts()
+        shocks = self.return_model.draw(self.rng, self.n_scenarios)
+        for index, (group, column) in enumerate(self.stochastic_columns):
+            group.balances[:, column] *= shocks[:, index]
+
+class HistogramQuantiles:
+    """Bounded-memory percentile estimator for (month, account) values streamed in chunks of paths.
+
+    Values are binned on a fixed grid in sign(x)*log1p(|x|) space between lower and upper (per month and account),
+    values outside the grid land in the edge bins. Counts from separate chunks or workers can simply be added."""
+
+    def __init__(self, lower, upper, bins = 512):
+        self.lower = np.asarray(lower, dtype=np.float64)
+        self.upper = np.asarray(upper, dtype=np.float64)
+        self.bins = bins
+        self.counts = np.zeros(self.lower.shape + (bins,), dtype=np.int64)
+
+    @staticmethod
+    def transform(values):
+        return np.sign(values)*np.log1p(np.abs(values))
+
+    @staticmethod
+    def inverse_transform(values):
+        return np.sign(values)*np.expm1(np.abs(values))
+
+    def update(self, month, values):
+        """Add (n_paths, n_accounts) values observed at a month."""
+        self.update_transformed(month, self.transform(values))
+
+    def update_transformed(self, month, transformed):
+        """update with values that already went through transform."""
+        lower, upper = self.lower[month], self.upper[month]
+        scaled = (transformed - lower) / (upper - lower) * self.bins
+        bin_index = np.clip(scaled.astype(np.int64), 0, self.bins - 1)
+        n_accounts = transformed.shape[1]
+        flat_index = (bin_index + np.arange(n_accounts)*self.bins).ravel()
+        self.counts[month] += np.bincount(flat_index, minlength=n_accounts*self.bins).reshape(n_accounts, self.bins)
+
+    def merge(self, other):
+        self.counts += other.counts
+        return self
+
+    def quantiles(self, percentiles):
+        """(n_percentiles, n_months, n_accounts) values, linearly interpolated within a bin."""
+        cumulative = np.cumsum(self.counts, axis=-1)
+        total = cumulative[..., -1:]
+        bin_width = (self.upper - self.lower) / self.bins
+        result = []
+        for percentile in percentiles:
+            target = total * percentile / 100
+            bin_index = np.minimum((cumulative < target).sum(axis=-1, keepdims=True), self.bins - 1)
+            below = np.take_along_axis(cumulative, bin_index, axis=-1) - np.take_along_axis(self.counts, bin_index, axis=-1)
+            in_bin = np.maximum(np.take_along_axis(self.counts, bin_index, axis=-1), 1)
+            position = (bin_index + np.clip((target - below) / in_bin, 0, 1))[..., 0]
+            result.append(self.inverse_transform(self.lower + position*bin_width))
+        return np.stack(result)
+
+def _run_paths(profile, return_model, years, n_paths, seed, month_callback):
+    """Simulate one chunk of paths without recording, calling month_callback(month, balances) every month."""
+    batch = MonteCarloBatch([profile]*n_paths, return_model, np.random.default_rng(seed))
+    batch.record = False
+    for month in range(years*12):
+        batch.advance_one_month()
+        month_callback(month, batch.account_balances)
+    return batch
+
+def _histogram_chunks(profile, return_model, years, chunks, lower, upper, bins):
+    """Worker task: stream a list of (n_paths, seed) chunks into one histogram."""
+    histogram = HistogramQuantiles(lower, upper, bins)
+    for n_paths, seed in chunks:
+        _run_paths(profile, return_model, years, n_paths, seed, histogram.update)
+    return histogram.counts
+
+def simulate_monte_carlo(profile : FinancialProfile, years : int, return_model : LognormalReturns, n_paths = 10000, seed = 0,
+                         chunk_size = 1000, n_workers = None, percentiles = (5, 25, 50, 75, 95), bins = 512):
+    """Percentile bands of every account in the "Accounts" table over n_paths random return paths.
+
+    Paths are simulated in chunks of chunk_size across a process pool (n_workers, all cores by default). Each chunk
+    gets its own child of the seed, so results do not depend on the number of workers. Only a histogram per
+    (month, account) is kept, never the paths themselves. The first chunk sets the histogram ranges and is binned
+    once they are known.
+
+    Returns a long table with Years, Account and one column per percentile (i.e. "P5")."""
+    n_workers = n_workers or os.cpu_count()
+    chunk_sizes = [chunk_size]*(n_paths // chunk_size) + ([n_paths % chunk_size] if n_paths % chunk_size else [])
+    chunks = list(zip(chunk_sizes, np.random.SeedSequence(seed).spawn(len(chunk_sizes))))
+    months = years*12
+
+    # First chunk for the histogram range (with some margin on both sides), kept to be binned afterwards
+    account_types = list(profile.all_balances_dict)
+    pilot = np.zeros((months, chunks[0][0], len(account_types)))
+    def keep_pilot(month, balances):
+        pilot[month] = HistogramQuantiles.transform(balances)
+    _run_paths(profile, return_model, years, chunks[0][0], chunks[0][1], keep_pilot)
+    pilot_lower, pilot_upper = pilot.min(axis=1), pilot.max(axis=1)
+    margin = np.maximum(0.25*(pilot_upper - pilot_lower), 1e-6)
+    lower, upper = pilot_lower - margin, pilot_upper + margin
+    histogram = HistogramQuantiles(lower, upper, bins)
+    for month in range(months):
+        histogram.update_transformed(month, pilot[month])
+    del pilot
+
+    # Spread the other chunks over the workers
+    tasks = [chunks[1:][worker::n_workers] for worker in range(n_workers) if chunks[1:][worker::n_workers]]
+    if len(tasks) == 1:
+        histogram.counts += _histogram_chunks(profile, return_model, years, tasks[0], lower, upper, bins)
+    elif len(tasks) > 1:
+        # Spawned, not forked: a forked child can deadlock in polars once the parent has used its thread pool
+        with ProcessPoolExecutor(max_workers=len(tasks), mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = [executor.submit(_histogram_chunks, profile, return_model, years, task, lower, upper, bins)
+                       for task in tasks]
+            for future in futures:
+                histogram.counts += future.result()
+
+    bands = histogram.quantiles(percentiles)
+    years_past = np.cumsum(np.concatenate([[profile.years_past], np.full(months, 1/12)]))[1:]
+    return pl.DataFrame(dict({"Years" : np.repeat(years_past, len(account_types)),
+                              "Account" : np.tile(account_types, months)},
+                             **{f"P{percentile}" : band.ravel() for percentile, band in zip(percentiles, bands)}))
@@ -1,27 +1,171 @@
+import abc
+import copy
+import functools
+import gc
+import weakref
+from collections.abc import Mapping
 import polars as pl
+from polars.io.plugins import register_io_source
 import numpy as np
-from helper_functions import calculate_net_income, flatten_investment_dict
+from helper_functions import TaxSchedule, flatten_investment_dict, column_dtype
+from instrumentation import StepInstrumentation
+from policy import AllocationPolicy, DEFAULT_POLICIES, STEP_METHODS, STEP_SETTINGS
+from timeline import Timeline, TimelineEvent
 
-class Debt:
-    """Class for any type of dept profile."""
-    def __init__(self, initial_outstanding_balance : float, 
-                 interest_rate : float, compounding : str, type : str):
+class SettingsVersion:
+    """Counter bumped by every in-place change to a job, need, insurance or interest rate, so values cached from
+    them (FinancialProfile.month_constants) know to recompute. Edits inside their dicts and lists are not seen, call
+    FinancialProfile.refresh() after those."""
+    version = 0
+    
+    @classmethod
+    def bump(cls):
+        cls.version+=1
+
+class TracksChanges:
+    """Bumps SettingsVersion whenever an attribute is set."""
+    
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        SettingsVersion.bump()
+
+class AccountLedger:
+    """Contiguous balances, interest rates and monthly growth factors of a set of accounts.
+    
+    Debt and Investment objects are views on one slot of a ledger, so every account of a profile matures with a
+    single vectorized multiply and its balances are snapshotted with one array copy."""
+    
+    def __init__(self, capacity : int = 8):
+        self.owner = None # Weak reference to the profile whose accounts these are, None for a lone account
+        self.size = 0
+        self.balances = np.zeros(capacity)
+        self.interest_rates = np.zeros(capacity)
+        self.growth = np.ones(capacity)
+        self.months_since_start = np.zeros(capacity, dtype=np.int64)
+        
+    def add(self, balance, interest_rate, growth, months_since_start = 0) -> int:
+        """Append an account and return its slot."""
+        if self.size == len(self.balances):
+            for name in ["balances", "interest_rates", "growth", "months_since_start"]:
+                values = getattr(self, name)
+                grown = np.zeros(2*len(values), dtype=values.dtype)
+                grown[:self.size] = values[:self.size]
+                setattr(self, name, grown)
+        index = self.size
+        self.balances[index] = balance
+        self.interest_rates[index] = interest_rate
+        self.growth[index] = growth
+        self.months_since_start[index] = months_since_start
+        self.size+=1
+        return index
+    
+    def mature_one_month(self):
+        self.balances[:self.size] *= self.growth[:self.size]
+        self.months_since_start[:self.size] += 1
+        
+    def __getstate__(self):
+        # The owner is a weak reference, an unpickled profile claims its ledger again (see FinancialProfile.__setstate__)
+        return dict(self.__dict__, owner=None)
+        
+    def copy(self) -> "AccountLedger":
+        """Copy of the values, not owned by any profile yet."""
+        ledger = AccountLedger(capacity=len(self.balances))
+        ledger.size = self.size
+        for name in ["balances", "interest_rates", "growth", "months_since_start"]:
+            setattr(ledger, name, getattr(self, name).copy())
+        return ledger
+
+class LedgerAccount(abc.ABC):
+    """Account whose balance, interest rate and growth live in an AccountLedger slot (its own until a profile adopts it).
+    
+    An account belongs to one profile at a time, build other profiles from new accounts (or fork the profile)."""
+    
+    __slots__ = ("ledger", "index", "compounding", "n", "initial_outstanding_balance", "type")
+    compounding_frequency = {
+        'daily': 365,
+        'monthly': 12,
+        'semi-annually': 2,
+        'annually': 1
+    }
+    
+    def __init__(self, initial_outstanding_balance : float, interest_rate : float, compounding : str, type : str):
         if compounding not in ['daily', 'monthly', 'semi-annually','annually']:
             raise ValueError("Invalid compounding frequency. Choose from 'daily', 'monthly', 'semi-annually', or 'annually'.")
         self.compounding = compounding
-        self.compounding_frequency = {
-            'daily': 365,
-            'monthly': 12,
-            'semi-annually': 2,
-            'annually': 1
-        }
-        self.n = self.compounding_frequency[self.compounding]
-        self.rate_per_period = interest_rate / self.n
+        self.n = self.compounding_frequency[compounding]
         self.initial_outstanding_balance = initial_outstanding_balance
-        self.outstanding_balance = initial_outstanding_balance
-        self.months_since_start = 0
         self.type = type
-        self.interest_rate=interest_rate
+        self.ledger = AccountLedger(capacity=1)
+        self.index = self.ledger.add(initial_outstanding_balance, interest_rate, self.growth_factor(interest_rate))
+        
+    @abc.abstractmethod
+    def growth_factor(self, interest_rate):
+        """Factor the balance grows by in one month at an interest rate."""
+    
+    def check_unowned(self):
+        """Raise if the account belongs to a profile that still exists."""
+        owner = self.ledger.owner
+        if owner is not None and owner() is not None:
+            gc.collect() # A profile that is only kept alive by its own reference cycles is gone
+            if owner() is not None:
+                raise ValueError(f"{type(self).__name__} {self.type} already belongs to another FinancialProfile, "
+                                 "build each profile from its own accounts or use profile.fork().")
+    
+    def move_to(self, ledger : AccountLedger):
+        """Move the account's values into another ledger and view them there (a profile adopts its accounts this way).
+        
+        Refuses to take an account away from another profile that still exists, that profile would keep maturing
+        the old slot while its payments and contributions land in the new one."""
+        self.check_unowned()
+        self.index = ledger.add(self.outstanding_balance, self.interest_rate, self.monthly_growth, self.months_since_start)
+        self.ledger = ledger
+        
+    @property
+    def outstanding_balance(self):
+        return self.ledger.balances[self.index]
+    
+    @outstanding_balance.setter
+    def outstanding_balance(self, balance):
+        self.ledger.balances[self.index] = balance
+        
+    @property
+    def interest_rate(self):
+        return self.ledger.interest_rates[self.index]
+    
+    @interest_rate.setter
+    def interest_rate(self, interest_rate):
+        self.ledger.interest_rates[self.index] = interest_rate
+        self.ledger.growth[self.index] = self.growth_factor(interest_rate)
+        SettingsVersion.bump()
+        
+    @property
+    def rate_per_period(self):
+        return self.interest_rate / self.n
+    
+    @property
+    def monthly_growth(self):
+        """Factor the balance grows by in one month."""
+        return self.ledger.growth[self.index]
+    
+    @property
+    def months_since_start(self):
+        return int(self.ledger.months_since_start[self.index])
+    
+    @months_since_start.setter
+    def months_since_start(self, months):
+        self.ledger.months_since_start[self.index] = months
+        
+    def mature_one_month(self, verbose = False):
+        self.months_since_start+=1
+        old_balance = self.outstanding_balance
+        self.outstanding_balance = self.outstanding_balance * self.monthly_growth
+        if verbose:
+            print(f"{type(self).__name__} {self.type} increases from ${old_balance} to {self.outstanding_balance}.")
+
+class Debt(LedgerAccount):
+    """Class for any type of dept profile."""
+    
+    __slots__ = ()
         
     def make_payment(self, amount):
         """Makes payment and updates loan."""
@@ -32,23 +176,52 @@ class Debt:
         amount = self.outstanding_balance * (1 + self.rate_per_period) ** total_periods
         return amount
 
-    def mature_one_month(self, verbose = False):
-        self.months_since_start+=1
+    def growth_factor(self, interest_rate):
         periods_in_month = (self.n / 12)
-        old_balance = self.outstanding_balance
-        self.outstanding_balance = self.outstanding_balance * (1 + self.interest_rate / self.n) ** (periods_in_month)
-        if verbose:
-            print(f"Debt {self.type} increases from ${old_balance} to {self.outstanding_balance}.")
-            
+        return (1 + interest_rate / self.n) ** (periods_in_month)
+    
+    @staticmethod
+    def annuity_balance(balance, growth, payment, months):
+        """Balance after `months` months of growth then a fixed payment: b*g^t - p*(g^t - 1)/(g - 1)."""
+        compounded = growth**months
+        with np.errstate(divide="ignore", invalid="ignore"):
+            annuity = np.where(growth == 1, months, (compounded - 1)/(growth - 1))
+        return balance*compounded - payment*annuity
+    
+    @staticmethod
+    def annuity_payoff(balance, growth, payment):
+        """Months until a balance is paid off by a fixed monthly payment (interest first, then the payment, as simulated)
+        and the size of the last payment, in closed form.
+        
+        Elementwise on arrays. Months are inf (and the last payment nan) when the payment never covers the interest."""
+        balance, growth, payment = np.broadcast_arrays(*[np.asarray(value, dtype=np.float64) for value in [balance, growth, payment]])
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            interest = balance*(growth - 1)
+            months = np.where(growth == 1, balance/payment, np.log(payment/(payment - interest))/np.log(growth))
+            months = np.where(payment > interest, np.maximum(np.ceil(months - 1e-9), 1), np.inf)
+            months = np.where(balance <= 0, 0.0, months)
+            last_payment = np.where(np.isfinite(months), Debt.annuity_balance(balance, growth, payment, months - 1)*growth, np.nan)
+        return months, np.where(months == 0, 0.0, last_payment)
+    
+    def payoff_months(self, payment):
+        """Months from now until the debt is paid off at a fixed monthly payment (or array of payments)."""
+        return self.annuity_payoff(self.outstanding_balance, self.monthly_growth, payment)[0]
     
-class Insurance:
+    def total_interest(self, payment):
+        """Interest paid until the debt is paid off at a fixed monthly payment (or array of payments)."""
+        months, last_payment = self.annuity_payoff(self.outstanding_balance, self.monthly_growth, payment)
+        with np.errstate(invalid="ignore"):
+            paid = np.where(months > 0, payment*(months - 1) + last_payment, 0.0)
+        return np.where(np.isfinite(months), paid - self.outstanding_balance, np.inf)
+    
+class Insurance(TracksChanges):
     """Insurance policy (employer or personal)."""
     
     def __init__(self, monthly_premium : float, type : str):
         self.monthly_premium=monthly_premium
         self.type = type
     
-class MonthlyNeededExpenses:
+class MonthlyNeededExpenses(TracksChanges):
     """Non-employer related expenses needed (i.e. pre-tax premiums not included)."""
     
     def __init__(self, rent : float, food : float, electric : float, 
@@ -77,41 +250,24 @@ class MonthlyNeededExpenses:
     def monthly_necessity_costs(self):
         return np.sum(list(self.monthly_necessity_costs_dict.values()))
 
-class Investment:
+class Investment(LedgerAccount):
     """All investment funds including 401K, HSA, etc. 
     
     in_tax: whetheror not money is taxed on the way in."""
     
+    __slots__ = ()
+    
     def __init__(self, initial_outstanding_balance : float, interest_rate : float, compounding : str, type : str):
-        if compounding not in ['daily', 'monthly', 'semi-annually','annually']:
-            raise ValueError("Invalid compounding frequency. Choose from 'daily', 'monthly', 'semi-annually', or 'annually'.")
-        self.compounding = compounding
-        self.compounding_frequency = {
-            'daily': 365,
-            'monthly': 12,
-            'semi-annually': 2,
-            'annually': 1
-        }
-        self.n = self.compounding_frequency[compounding]
-        self.rate_per_period = interest_rate / self.n
-        self.initial_outstanding_balance = np.float64(initial_outstanding_balance)
-        self.outstanding_balance = np.float64(initial_outstanding_balance)
-        self.months_since_start = 0
-        self.interest_rate=interest_rate
-        self.type=type
+        super().__init__(np.float64(initial_outstanding_balance), interest_rate, compounding, type)
         
     def contribute_funds(self, amount):
         self.outstanding_balance+=amount
         
-    def mature_one_month(self, verbose = False):
-        self.months_since_start+=1
+    def growth_factor(self, interest_rate):
         periods_in_month = (self.n / 365) * 30.5
-        old_balance = self.outstanding_balance
-        self.outstanding_balance = self.outstanding_balance * (1 + self.interest_rate / self.n) ** (self.n * periods_in_month)
-        if verbose:
-            print(f"Investment {self.type} increases from ${old_balance} to {self.outstanding_balance}.")
+        return (1 + interest_rate / self.n) ** (self.n * periods_in_month)
     
-class EmployerBenefits:
+class EmployerBenefits(TracksChanges):
     """Defines, stores, and calculates expendature into employer matched funds."""
     
     def __init__(self, salary : float, retirement_matching : dict, 
@@ -130,27 +286,255 @@ class EmployerBenefits:
         funds_cont.update(self.monthly_flat_rate_contributions)
         return funds_cont
     
-class FinancialProfile:
+class MonthlyRecorder:
+    """Preallocated columnar buffer holding one row per simulated month for every output table.
+
+    layout: {table name : {column name : numpy dtype}}, column order is kept in the materialized frames.
+    width: number of scenarios recorded side by side per month (None for a single profile)."""
+
+    def __init__(self, layout : dict, capacity : int = 12, width : int = None):
+        self.layout = layout
+        self.width = width
+        self.row = 0
+        self.start = 0 # First row not yet handed out by discard
+        self.allocations = 0 # Column buffers and frames created so far
+        self.capacity = 0
+        self.owned = True
+        self.columns = dict({table : dict() for table in layout})
+        self.reserve(capacity)
+
+    def reserve(self, months):
+        """Make sure there is room for `months` more rows, growing every column at once if needed.
+        
+        Buffers shared with a snapshot or a materialized frame are copied here first, so they are never written again."""
+        needed = self.row + months
+        if needed <= self.capacity and self.owned:
+            return
+        capacity = max(needed, 2*self.capacity) if needed > self.capacity else self.capacity
+        for table, table_layout in self.layout.items():
+            for column, dtype in table_layout.items():
+                grown = np.zeros(capacity if self.width is None else (capacity, self.width), dtype=dtype)
+                if column in self.columns[table]:
+                    grown[:self.row] = self.columns[table][column][:self.row]
+                self.columns[table][column] = grown
+                self.allocations+=1
+        self.capacity = capacity
+        self.owned = True
+
+    def share(self):
+        """Copy-on-write view of the recorded rows, whichever side writes next copies the buffers first."""
+        shared = copy.copy(self)
+        shared.columns = dict({table : dict(table_columns) for table, table_columns in self.columns.items()})
+        self.owned = shared.owned = False
+        return shared
+
+    def write(self, table, column, value):
+        self.columns[table][column][self.row] = value
+
+    def write_dict(self, table, values : dict):
+        table_columns = self.columns[table]
+        row = self.row
+        for column, value in values.items():
+            table_columns[column][row] = value
+
+    def next_row(self):
+        self.row += 1
+        
+    def discard(self, keep = 2):
+        """Drop the recorded rows except the last `keep` ones (kept for fast forward checks but no longer in the frames).
+        
+        Fresh buffers are allocated, so frames materialized before stay valid."""
+        keep = min(keep, self.row)
+        for table_columns in self.columns.values():
+            for column, values in table_columns.items():
+                kept = np.zeros_like(values)
+                kept[:keep] = values[self.row-keep:self.row]
+                table_columns[column] = kept
+                self.allocations+=1
+        self.row = self.start = keep
+        self.owned = True
+
+    def extend(self, layout : dict):
+        """Record the columns of a new layout as well (zero in the rows before), promoting dtypes where they changed.
+        
+        Columns take the new layout's order, columns missing from it (closed accounts) stay at the end with zeros."""
+        merged = dict()
+        for table, table_layout in layout.items():
+            old_layout = self.layout.get(table, dict())
+            merged[table] = dict({column : np.result_type(dtype, old_layout[column]) if column in old_layout else np.dtype(dtype)
+                                  for column, dtype in table_layout.items()})
+            merged[table].update({column : np.dtype(dtype) for column, dtype in old_layout.items() if column not in table_layout})
+        for table, table_layout in merged.items():
+            table_columns = self.columns.get(table, dict())
+            for column, dtype in table_layout.items():
+                if column not in table_columns or table_columns[column].dtype != dtype:
+                    grown = np.zeros(self.capacity if self.width is None else (self.capacity, self.width), dtype=dtype)
+                    if column in table_columns:
+                        grown[:self.row] = table_columns[column][:self.row]
+                    table_columns[column] = grown
+                    self.allocations+=1
+            self.columns[table] = dict({column : table_columns[column] for column in table_layout})
+        self.layout = merged
+
+    def frame(self, table, columns = None):
+        """Materialize the recorded rows of a table, or only some of its columns (numpy buffers are shared, not copied).
+        
+        With a width, rows are stacked scenario by scenario behind a leading "Scenario" column."""
+        self.owned = False
+        self.allocations+=1
+        return self._build_frame(self.columns[table], self.start, self.row, self.width, columns)
+    
+    @staticmethod
+    def _build_frame(table_columns, start, row, width, columns = None):
+        columns = (["Scenario"] if width is not None else []) + list(table_columns) if columns is None else columns
+        if width is None:
+            return pl.DataFrame({column : table_columns[column][start:row] for column in columns})
+        return pl.DataFrame({column : np.repeat(np.arange(width), row - start) if column == "Scenario" else table_columns[column][start:row].T.ravel()
+                             for column in columns})
+    
+    def scan(self, table) -> pl.LazyFrame:
+        """Lazy view of the rows recorded so far, a query only turns the columns it selects into a frame."""
+        self.owned = False
+        table_columns, start, row, width = dict(self.columns[table]), self.start, self.row, self.width
+        schema = dict({"Scenario" : pl.Int64}) if width is not None else dict()
+        schema.update({column : pl.Int64 if np.dtype(dtype).kind == "i" else pl.Float64 for column, dtype in self.layout[table].items()})
+        def source(with_columns, predicate, n_rows, batch_size):
+            self.allocations+=1
+            frame = self._build_frame(table_columns, start, row, width, with_columns)
+            if predicate is not None:
+                frame = frame.filter(predicate)
+            yield frame if n_rows is None else frame.head(n_rows)
+        return register_io_source(source, schema=schema)
+    
+    def scenario_frame(self, table, scenario):
+        """Recorded rows of a single scenario, shaped like the single profile tables."""
+        self.owned = False
+        self.allocations+=1
+        return pl.DataFrame({column : values[self.start:self.row, scenario] for column, values in self.columns[table].items()})
+
+class ResultTables(Mapping):
+    """Output tables of a run, {table name : LazyFrame} underneath.
+
+    Indexing collects (and keeps) a single table, so only the tables that are looked at get built. Use lazy(table) to
+    select columns or filter first."""
+
+    def __init__(self, lazy_tables : dict):
+        self.lazy_tables = lazy_tables
+        self.collected = dict()
+
+    def lazy(self, table) -> pl.LazyFrame:
+        return self.lazy_tables[table]
+
+    def long(self, scenario_id = None, float32 = False) -> pl.LazyFrame:
+        """See long_results."""
+        return long_results(self, scenario_id, float32)
+
+    def __getitem__(self, table) -> pl.DataFrame:
+        if table not in self.collected:
+            self.collected[table] = self.lazy_tables[table].collect()
+        return self.collected[table]
+
+    def __iter__(self):
+        return iter(self.lazy_tables)
+
+    def __len__(self):
+        return len(self.lazy_tables)
+
+def left_to_right_sum(columns : list, start) -> pl.Expr:
+    """start + first column + second column ..., in that order (like summing the monthly values in a loop)."""
+    return functools.reduce(lambda total, column: total + pl.col(column), columns, pl.lit(start))
+
+def derived_tables(spent : pl.LazyFrame, accounts : pl.LazyFrame, paycheck_only_spending_columns : list, matched_columns : list,
+                   ira_columns : list, debt_columns : list, need_columns : list) -> ResultTables:
+    """The four output tables, "Paycheck Only Spending" and "Simplified Spending" as projections and sums of "Spent"."""
+    keys = ["Scenario"] if "Scenario" in spent.collect_schema() else []
+    need_columns = [column for column in need_columns if column != "Minimum Leisure"]
+    simplified = spent.select(*keys, "Years",
+                              ((pl.col("Emergency Fund") + pl.col("Excess Savings")) + pl.col("Post-Deduction Savings")).alias("Savings"),
+                              ((left_to_right_sum(matched_columns, 0.0) + left_to_right_sum(ira_columns, 0.0)) + 
+                               (pl.col("Excess 401K") + pl.col("Excess IRA"))).alias("Retirement/Health"),
+                              left_to_right_sum(debt_columns, 0.0).alias("Loans"),
+                              ((pl.col("Minimum Leisure") + pl.col("Excess Leisure")) + pl.col("Post-Deduction Leisure")).cast(pl.Float64).alias("Leisure"),
+                              left_to_right_sum(need_columns, 0).cast(pl.Float64).alias("Need"))
+    return ResultTables(dict({"Spent" : spent,
+                              "Accounts" : accounts,
+                              "Paycheck Only Spending" : spent.select(keys + paycheck_only_spending_columns),
+                              "Simplified Spending" : simplified}))
+
+def long_results(results : Mapping, scenario_id = None, float32 = False) -> pl.LazyFrame:
+    """"Spent" and "Accounts" tables of simulate_n_years (or a batch) as one long table with a row per value:
+    scenario_id, month (0 is the first simulated month), account, kind ("Spent" or "Balance") and amount.
     
+    scenario_id and account are categorical and kind an enum, so tables of different profiles concatenate without
+    reconciling schemas. Batch scenarios get their Scenario number as id (behind scenario_id and a colon if given).
+    float32 halves the size of the amount column."""
+    amount_dtype = pl.Float32 if float32 else pl.Float64
+    lazy = results.lazy if isinstance(results, ResultTables) else lambda table: results[table].lazy()
+    parts = []
+    for table, kind, month_offset in [("Spent", "Spent", 0), ("Accounts", "Balance", 1)]:
+        frame = lazy(table)
+        value_columns = [column for column in frame.collect_schema() if column not in ["Scenario", "Years"]]
+        if "Scenario" in frame.collect_schema():
+            scenario = pl.col("Scenario").cast(pl.String)
+            scenario = scenario if scenario_id is None else pl.concat_str(pl.lit(f"{scenario_id}:"), scenario)
+        else:
+            scenario = pl.lit("0" if scenario_id is None else str(scenario_id))
+        parts.append(frame.select(scenario.cast(pl.Categorical).alias("scenario_id"),
+                                  ((pl.col("Years")*12).round().cast(pl.Int32) - month_offset).alias("month"),
+                                  pl.col(value_columns).cast(amount_dtype))
+                          .unpivot(index=["scenario_id", "month"], variable_name="account", value_name="amount")
+                          .select("scenario_id", "month", pl.col("account").cast(pl.Categorical),
+                                  pl.lit(kind, dtype=pl.Enum(["Spent", "Balance"])).alias("kind"), "amount"))
+    return pl.concat(parts, how="vertical")
+
+class ProfileSnapshot:
+    """Running state of a FinancialProfile at one month: account balances, counters and the recorded rows so far.
+    
+    Balances are a copy of the profile's ledger (by slot), recorded rows a copy-on-write recorder view."""
+    
+    def __init__(self, profile):
+        self.balances = profile.ledger.balances[:profile.ledger.size].copy()
+        self.months_since_start = profile.ledger.months_since_start[:profile.ledger.size].copy()
+        self.years_past = profile.years_past
+        self.current_month_leftover_net_income = profile.current_month_leftover_net_income
+        self.matching_amounts_left = profile.matching_amounts_left.copy()
+        self.spent_401 = profile.spent_401
+        self.spent_IRA = profile.spent_IRA
+        self.recorder = None if profile.recorder is None else profile.recorder.share()
+        self.lineage = profile.lineage
+        self.structure = profile.structure
+        self.employer_benefits = profile.employer_benefits
+        self.monthly_needs = profile.monthly_needs
+        
+    @property
+    def recorded_months(self):
+        return 0 if self.recorder is None else self.recorder.row
+
+class FinancialProfile:
+
     def __init__(self, debts : dict[Debt], investments : dict[dict[Investment]], 
                  monthly_needs : dict[MonthlyNeededExpenses], employer_benefits : dict[EmployerBenefits],
                  maximum_monthly_loan_payment : float, federal_tax_brackets : list[tuple], 
                  standard_deduction : float, fica_rate : float, state_tax_rate : float, 
-                 max_401K_legal : float, max_IRA_legal : float, prioritize_matching_over_emergency_fund : bool):
-        self.debts=sorted(debts.values(), key=lambda x: x.interest_rate, reverse=True) # Sort objects by interest_rate in decreasing order
-        self.short_term_investments=sorted(investments["Short Term"].values(), key=lambda x: x.interest_rate, reverse=True)
-        self.employer_matched_investments=sorted(investments["Employer Matched Retirement"].values(), key=lambda x: x.interest_rate, reverse=True)
-        self.other_ira_investments=sorted(investments["IRA"].values(), key=lambda x: x.interest_rate, reverse=True)
-        self.other_investments=sorted(investments["Other"].values(), key=lambda x: x.interest_rate, reverse=True)
-        self.employer_flat_rate_investments=sorted(investments["Employer Flat Rate Retirement"].values(), key=lambda x: x.interest_rate, reverse=True)
+                 max_401K_legal : float, max_IRA_legal : float, prioritize_matching_over_emergency_fund : bool,
+                 savings_leftover_percent : float = 0.5, leisure_leftover_percent : float = 0.5,
+                 policy : AllocationPolicy = None):
+        self.debts_dict=debts
+        self.investments=investments
+        self.ledger = AccountLedger(capacity=len(debts) + sum(len(category_dict) for category_dict in investments.values()))
+        self.ledger.owner = weakref.ref(self)
+        self.accounts_by_slot = [] # Every account ever adopted into the ledger, by slot
+        self.sort_accounts()
         self.monthly_needs=monthly_needs
         self.employer_benefits=employer_benefits
         self.current_month_leftover_net_income = 0
-        self.spent_df_list = []
-        self.records_df_list = []
+        self.recorder = None
+        self.column_kinds = dict() # Kind of every recorded column ever laid out, also of closed accounts
+        self.instrumentation = None
         self.years_past = 0.0
-        self.investments=investments
-        self.flattened_investment_dict = flatten_investment_dict(self.investments)
+        self.timeline = Timeline()
+        self._month_constants_sources = None
+        self.lineage = object() # Shared with forks, snapshots only restore into the same lineage
         self.maximum_monthly_loan_payment=maximum_monthly_loan_payment
         self.matching_amounts_left = self.monthly_pre_net_income_investment_contributions.copy()
         self.spent_401=0
@@ -161,18 +545,102 @@ class FinancialProfile:
         self.state_tax_rate=state_tax_rate
         self.max_401K_legal=max_401K_legal
         self.max_IRA_legal=max_IRA_legal
-        self.paycheck_only_spending_df_list=[]
-        self.simplified_df_list=[]
         self.prioritize_matching_over_emergency_fund=prioritize_matching_over_emergency_fund
+        self.savings_leftover_percent=savings_leftover_percent
+        self.leisure_leftover_percent=leisure_leftover_percent
+        self.policy=policy # None runs the default order for prioritize_matching_over_emergency_fund
+        self._plan_sources = None
+        self._tax_schedule = None
+        self.initial_snapshot = self.snapshot()
+        
+    def sort_accounts(self):
+        """Sorted account lists and ledger slots of the debts_dict and investments, adopting new accounts into the ledger."""
+        self.debts=sorted(self.debts_dict.values(), key=lambda x: x.interest_rate, reverse=True) # Sort objects by interest_rate in decreasing order
+        self.short_term_investments=sorted(self.investments["Short Term"].values(), key=lambda x: x.interest_rate, reverse=True)
+        self.employer_matched_investments=sorted(self.investments["Employer Matched Retirement"].values(), key=lambda x: x.interest_rate, reverse=True)
+        self.other_ira_investments=sorted(self.investments["IRA"].values(), key=lambda x: x.interest_rate, reverse=True)
+        self.other_investments=sorted(self.investments["Other"].values(), key=lambda x: x.interest_rate, reverse=True)
+        self.employer_flat_rate_investments=sorted(self.investments["Employer Flat Rate Retirement"].values(), key=lambda x: x.interest_rate, reverse=True)
+        self.flattened_investment_dict = flatten_investment_dict(self.investments)
+        new_accounts = [account for account in dict.fromkeys(self.all_accounts + list(self.flattened_investment_dict.values()))
+                        if account.ledger is not self.ledger]
+        for account in new_accounts: # All checked before any is moved
+            account.check_unowned()
+        for account in new_accounts:
+            account.move_to(self.ledger)
+            self.accounts_by_slot.append(account)
+        self.account_slots = np.array([account.index for account in self.all_accounts], dtype=np.int64) # Ledger slots in all_accounts order
+        self.account_types = [account.type for account in self.all_accounts]
+        self.structure = dict({"Debts" : dict({name : debt.index for name, debt in self.debts_dict.items()})})
+        self.structure.update({category : dict({name : account.index for name, account in category_dict.items()})
+                               for category, category_dict in self.investments.items()})
+        
+    @property
+    def tax_schedule(self) -> TaxSchedule:
+        """Compiled tax schedule for the current tax settings (recompiled only when they change)."""
+        tax_settings = (tuple(self.federal_tax_brackets), self.standard_deduction, self.state_tax_rate, self.fica_rate)
+        if self._tax_schedule is None or self._tax_settings != tax_settings:
+            self._tax_schedule = TaxSchedule(federal_tax_brackets = self.federal_tax_brackets, 
+                                             standard_deduction = self.standard_deduction, 
+                                             state_tax_rate = self.state_tax_rate, 
+                                             fica_rate = self.fica_rate)
+            self._tax_settings = tax_settings
+        return self._tax_schedule
         
     def monthly_net_income(self, additional_deductions):
         """Monthly income post-pre-tax-investment contribution, insurance premiums, and taxes."""
-        return calculate_net_income(gross_income = np.sum([job.salary for job in self.employer_benefits.values()]), 
-                                    standard_deduction = self.standard_deduction, 
-                                    federal_tax_brackets = self.federal_tax_brackets, 
-                                    state_tax_rate = self.state_tax_rate, 
-                                    fica_rate = self.fica_rate,
-                                    additional_deductions = additional_deductions)/12
+        return self.tax_schedule.net_income(gross_income = self.month_constants["Gross Income"], 
+                                            additional_deductions = additional_deductions)/12
+    
+    @property
+    def month_constants(self) -> dict:
+        """Values every month reuses as long as the jobs, needs and debts stay the same.
+        
+        Recomputed when one of employer_benefits, monthly_needs or debts is replaced (as events and forks do), when
+        an attribute of a job, need, insurance or interest rate is set (see SettingsVersion) and after refresh()."""
+        sources = (self.employer_benefits, self.monthly_needs, self.debts)
+        if self._month_constants_sources is None or self._month_constants_version != SettingsVersion.version or \
+                any(source is not cached for source, cached in zip(sources, self._month_constants_sources)):
+            total_need_spend = 0
+            need_spend = dict()
+            for need_object in self.monthly_needs.values():
+                total_need_spend+=need_object.monthly_necessity_costs
+                need_spend.update(need_object.monthly_necessity_costs_dict)
+            self._month_constants = dict({"Gross Income" : np.sum([job.salary for job in self.employer_benefits.values()]),
+                                          "Matching Amounts" : self.monthly_pre_net_income_investment_contributions,
+                                          "Need Spend" : need_spend,
+                                          "Total Need Spend" : total_need_spend,
+                                          "Monthly Need Expendature" : self.monthly_need_expendature,
+                                          "Highest Interest Debt" : self.highest_interest_debt if self.debts else -np.inf})
+            self._month_constants_sources = sources
+            self._month_constants_version = SettingsVersion.version
+        return self._month_constants
+    
+    def refresh(self):
+        """Recompute the cached month constants, i.e. after editing a job's retirement_matching dict in place."""
+        self._month_constants_sources = None
+        
+    @property
+    def allocation_policy(self) -> AllocationPolicy:
+        return self.policy if self.policy is not None else DEFAULT_POLICIES[bool(self.prioritize_matching_over_emergency_fund)]
+    
+    @property
+    def plan(self) -> tuple:
+        """The allocation policy compiled into (step functions with their settings bound, positions of the matching and
+        IRA steps, post-deduction savings share). Recompiled when the policy, instrumentation or leftover split changes."""
+        policy = self.allocation_policy
+        sources = (policy, self.instrumentation, self.savings_leftover_percent, self.leisure_leftover_percent)
+        if self._plan_sources is None or any(source is not cached for source, cached in zip(sources, self._plan_sources)):
+            functions = []
+            for step, settings in policy.steps:
+                keywords = dict(zip(STEP_SETTINGS[step], settings))
+                if step == "leftover":
+                    keywords = dict({"savings_leftover_percent" : self.savings_leftover_percent,
+                                     "leisure_leftover_percent" : self.leisure_leftover_percent})
+                functions.append(functools.partial(getattr(self, STEP_METHODS[step]), **keywords))
+            self._plan = (functions, policy.order.index("matching"), policy.order.index("ira"), policy.post_deduction_savings_share)
+            self._plan_sources = sources
+        return self._plan
         
     @property
     def monthly_pre_net_income_investment_contributions(self) -> dict:
@@ -193,20 +661,60 @@ class FinancialProfile:
                 in need_onject.monthly_necessity_costs_dict.items() if need_name != "Mandatory Savings"])
         return need_non_savings
     
+    @property
+    def monthly_needs_spent_dict(self):
+        """Need costs of every MonthlyNeededExpenses merged into one dict, as recorded in the spending tables."""
+        spent_dict = dict()
+        for need_object in self.monthly_needs.values():
+            spent_dict.update(need_object.monthly_necessity_costs_dict)
+        return spent_dict
+    
     @property
     def highest_interest_debt(self):
         return np.max([this_dept.interest_rate for this_dept in self.debts])
     
+    def avalanche_payoff(self, payments = None) -> dict:
+        """Payoff month (from now, 1 is the next month) and total interest of every debt in closed form, paying a fixed
+        amount a month in the order Step 3 pays (highest rate first, what a payoff month leaves goes to the next debt).
+        
+        payments: monthly payment or array of payment levels, maximum_monthly_loan_payment by default. Assumes the whole
+        payment is left over every month. Returns {debt type : (payoff months, total interest)}, inf for never."""
+        payments = np.asarray(self.maximum_monthly_loan_payment if payments is None else payments, dtype=np.float64)
+        start = np.ones(payments.shape) # Month a debt gets its first payment
+        remainder = payments.copy() # What is left for it in that month
+        schedule = dict()
+        for debt in self.debts:
+            balance, growth = debt.outstanding_balance, debt.monthly_growth
+            with np.errstate(invalid="ignore", over="ignore"):
+                matured = balance*growth**start
+                first_payment = np.minimum(remainder, matured)
+                months, last_payment = Debt.annuity_payoff(matured - first_payment, growth, payments)
+                paid = first_payment + np.where(months > 0, payments*(months - 1) + last_payment, 0.0)
+                paid_off = np.where(np.isfinite(start), start + months, np.inf)
+                interest = np.where(np.isfinite(paid_off), paid - balance, np.inf)
+                remainder = np.where(months > 0, payments - last_payment, remainder - first_payment)
+            if balance <= 0:
+                paid_off, interest = np.zeros(payments.shape), np.zeros(payments.shape)
+            else:
+                start = paid_off
+            schedule[debt.type] = (paid_off, interest)
+        return schedule
+    
+    def debt_free_month(self, payments = None):
+        """Month (from now) the last debt is paid off, see avalanche_payoff."""
+        schedule = self.avalanche_payoff(payments)
+        return np.max([paid_off for paid_off, interest in schedule.values()], axis=0, initial=0)
+    
     ### Complete Monthly Step Check Functions
     
     def get_non_decision_determined_updates(self, verbose=False):
         """Step -1: Do things that occur regardless of decisions."""
         # Mature Depts and Investments
-        for dept in self.debts:
-            dept.mature_one_month(verbose=verbose)
-        for investment_type, investment_type_dict in self.investments.items():
-            for investment_type, investment_object in investment_type_dict.items():
-                investment_object.mature_one_month(verbose=verbose)   
+        if verbose:
+            for account in self.accounts_by_slot:
+                account.mature_one_month(verbose=verbose)
+        else:
+            self.ledger.mature_one_month()
         # Make money
         self.current_month_leftover_net_income+=self.monthly_net_income(additional_deductions=0)
         if verbose:
@@ -214,7 +722,7 @@ class FinancialProfile:
         # Mature time
         self.years_past+=1/12
         # Reset matching amounts
-        self.matching_amounts_left = self.monthly_pre_net_income_investment_contributions.copy()
+        self.matching_amounts_left = self.month_constants["Matching Amounts"].copy()
         self.spent_401=0
         self.spent_IRA=0
         # Contribnute employer flat rate amounts
@@ -225,36 +733,37 @@ class FinancialProfile:
 
     def get_monthly_spend_on_needs(self, verbose = False):
         """Step 0: Spend money on determined needs."""
-        total_need_spend=0
-        spent_dict = dict()
-        for need_name, need_object in self.monthly_needs.items():
-            spend = need_object.monthly_necessity_costs
-            if verbose:
-                print(f"Spend ${spend} on {need_name}.")
-            total_need_spend+=spend
-            spent_dict.update(need_object.monthly_necessity_costs_dict)
-        self.current_month_leftover_net_income-=total_need_spend
-        return pl.DataFrame(spent_dict)
+        if verbose:
+            for need_name, need_object in self.monthly_needs.items():
+                print(f"Spend ${need_object.monthly_necessity_costs} on {need_name}.")
+        spent_dict = self.month_constants["Need Spend"]
+        self.current_month_leftover_net_income-=self.month_constants["Total Need Spend"]
+        self.recorder.write_dict("Spent", spent_dict)
+        return spent_dict
         
-    def get_monthly_emergency_fund_expendature(self,verbose=False):
-        """Step 1: Build Emergency Fund of 6 months."""
+    def get_monthly_emergency_fund_expendature(self,verbose=False, months=6, high_interest_rate=0.15):
+        """Step 1: Build Emergency Fund of 6 months (by default)."""
+        short_term_savings_total = self.short_term_savings_total
+        monthly_need_expendature = self.month_constants["Monthly Need Expendature"]
+        highest_interest_debt = self.month_constants["Highest Interest Debt"]
         # Usual Case
-        if (self.short_term_savings_total >= self.monthly_need_expendature*6):
+        if (short_term_savings_total >= monthly_need_expendature*months):
             needed_to_complete_emergency_funds = 0.0
         else:
-            needed_to_complete_emergency_funds = min(self.current_month_leftover_net_income, self.monthly_need_expendature*6-self.short_term_savings_total)
+            needed_to_complete_emergency_funds = min(self.current_month_leftover_net_income, monthly_need_expendature*months-short_term_savings_total)
         # High Interest Dept Exception Case
-        if (self.highest_interest_debt >= 0.15) and (self.short_term_savings_total >= self.monthly_need_expendature):
+        if (highest_interest_debt >= high_interest_rate) and (short_term_savings_total >= monthly_need_expendature):
             needed_to_complete_emergency_funds=0.0
-        if (self.short_term_savings_total < self.monthly_need_expendature) and (self.highest_interest_debt > 0.15):
-            needed_to_complete_emergency_funds = min(self.current_month_leftover_net_income, self.monthly_need_expendature-self.short_term_savings_total)
+        if (short_term_savings_total < monthly_need_expendature) and (highest_interest_debt > high_interest_rate):
+            needed_to_complete_emergency_funds = min(self.current_month_leftover_net_income, monthly_need_expendature-short_term_savings_total)
         self.current_month_leftover_net_income-=needed_to_complete_emergency_funds
         # Allocate equally accross short term savings accounts
         for bank_account in self.short_term_investments:
             bank_account.contribute_funds(needed_to_complete_emergency_funds/len(self.short_term_investments))
         if verbose:
             print(f"Spend ${needed_to_complete_emergency_funds} on emergency fund.")
-        return pl.DataFrame({"Emergency Fund" : needed_to_complete_emergency_funds})
+        self.recorder.write("Spent", "Emergency Fund", needed_to_complete_emergency_funds)
+        return needed_to_complete_emergency_funds
         
     def get_monthly_contribution_to_employer_matching(self,verbose=False):
         """Step 2: Contribute to employer matching funds."""
@@ -271,7 +780,8 @@ class FinancialProfile:
                 print(f"WARNING: Did not complete matching for {investment_object.type} due to insufficient funds.")
             true_contribution_amounts.update({investment_object.type : feasible_contribution_amount})
             self.spent_401+=feasible_contribution_amount
-        return pl.DataFrame(true_contribution_amounts)
+        self.recorder.write_dict("Spent", true_contribution_amounts)
+        return true_contribution_amounts
     
     def pay_off_high_interest_debt(self,verbose=False):
         """Step 3: Pay off high interest debt."""
@@ -286,14 +796,14 @@ class FinancialProfile:
             debt_contribution_dict.update({debt.type : feasible_contribution_amount})
             if verbose:
                 print(f"Spend ${feasible_contribution_amount} on {debt.type} for dept payoff.")
-        return pl.DataFrame(debt_contribution_dict)
+        self.recorder.write_dict("Spent", debt_contribution_dict)
+        return debt_contribution_dict
             
-    def get_IRA_contribution(self,verbose=False):
+    def get_IRA_contribution(self,verbose=False, yearly_limit=7000):
         """Step 4: Contribute to IRA. Does so evenly across IRAs if you have multiple (still dont understand why you would)."""
         ira_contribution_dict = dict()
         num_iras = len(self.other_ira_investments)
-        max_yearly_contribution = 7000 # as of 2024
-        per_account = max_yearly_contribution / num_iras / 12
+        per_account = yearly_limit / num_iras / 12 # 7000 as of 2024
         for investment_object in self.other_ira_investments:
             feasible_contribution_amount = min(self.current_month_leftover_net_income, per_account)
             investment_object.contribute_funds(feasible_contribution_amount)
@@ -302,7 +812,8 @@ class FinancialProfile:
             self.current_month_leftover_net_income -= feasible_contribution_amount
             ira_contribution_dict[investment_object.type]=feasible_contribution_amount
             self.spent_IRA+=feasible_contribution_amount
-        return pl.DataFrame(ira_contribution_dict)
+        self.recorder.write_dict("Spent", ira_contribution_dict)
+        return ira_contribution_dict
     
     def allocate_savings_and_leisure_funds(self,
                                            savings_leftover_percent = 0.5, leisure_leftover_percent = 0.5, verbose=False):
@@ -341,77 +852,432 @@ class FinancialProfile:
             bank_account.contribute_funds(amount)
         if verbose:
             print(f"Spend ${leftover*leisure_leftover_percent} on leftover leisure.")
-        return pl.DataFrame({"Excess 401K" : excess_401,
-                             "Excess IRA" : excess_IRA,
-                             "Excess Savings" : leftover*savings_leftover_percent,
-                             "Excess Leisure" : leftover*leisure_leftover_percent})
+        excess_dict = dict({"Excess 401K" : excess_401,
+                            "Excess IRA" : excess_IRA,
+                            "Excess Savings" : leftover*savings_leftover_percent,
+                            "Excess Leisure" : leftover*leisure_leftover_percent})
+        self.recorder.write_dict("Spent", excess_dict)
+        return excess_dict
+    
+    ### Output Recording
+    
+    @property
+    def all_accounts(self) -> list:
+        """Every debt and investment in the column order of the "Accounts" table."""
+        return [account for account_types in [self.short_term_investments, self.debts, self.employer_matched_investments, 
+                                              self.employer_flat_rate_investments, self.other_ira_investments, self.other_investments]
+                for account in account_types]
+    
+    @property
+    def all_balances_dict(self) -> dict:
+        return dict(zip(self.account_types, self.ledger.balances[self.account_slots].tolist()))
+    
+    def recorder_layout(self) -> dict:
+        """Column names and dtypes of every output table, in the order the tables have always been built."""
+        need_columns = dict({need_name : column_dtype(need_value) for need_name, need_value in self.monthly_needs_spent_dict.items()})
+        deduction_columns = [investment_object.type for investment_object in self.employer_matched_investments] + \
+            [investment_object.type for investment_object in self.other_ira_investments] + ["Excess 401K", "Excess IRA"]
+        general_columns = list(need_columns) + ["Emergency Fund"] + [debt.type for debt in self.debts] + \
+            ["Excess Savings", "Excess Leisure", "Post-Deduction Savings", "Post-Deduction Leisure"]
+        spent_columns = ["Years"] + list(dict.fromkeys(deduction_columns)) + list(dict.fromkeys(general_columns))
+        if len(set(spent_columns)) != len(spent_columns):
+            raise ValueError("Spending columns must have unique names across needs, debts and investments.")
+        self.column_kinds.update({column : "Need" for column in need_columns})
+        self.column_kinds.update({debt.type : "Debt" for debt in self.debts})
+        self.column_kinds.update({investment_object.type : "Matched" for investment_object in self.employer_matched_investments})
+        self.column_kinds.update({investment_object.type : "IRA" for investment_object in self.other_ira_investments})
+        return dict({"Spent" : dict({column : need_columns.get(column, np.float64) for column in spent_columns}),
+                     "Accounts" : dict({column : np.float64 for column in ["Years"] + list(self.all_balances_dict)})})
+    
+    def recorded_columns(self, kind) -> list:
+        """Recorded spending columns of a kind (Need, Debt, Matched or IRA) in column order, including closed accounts."""
+        return [column for column in self.recorder.layout["Spent"] if self.column_kinds.get(column) == kind]
+    
+    @property
+    def paycheck_only_spending_columns(self) -> list:
+        return [column for column in self.recorder.layout["Spent"]
+                if self.column_kinds.get(column) not in ["Matched", "IRA"] and column not in ["Excess 401K", "Excess IRA"]]
         
     def advance_one_month(self, verbose = False):
         """Tasks that happen irregardless of above steps (i.e. employer autocontribution to HSA due to HDHP health plan)."""
+        if self.recorder is None:
+            self.recorder = MonthlyRecorder(self.recorder_layout())
+        if self.timeline.next_month <= self.current_month:
+            self.apply_due_events(verbose=verbose)
+        recorder = self.recorder
+        recorder.reserve(1)
         # Go through steps
-        base_df = pl.DataFrame({"Years" : self.years_past})
+        recorder.write("Spent", "Years", self.years_past)
         self.get_non_decision_determined_updates(verbose=verbose)
-        step_0 = self.get_monthly_spend_on_needs(verbose=verbose)
-        if self.prioritize_matching_over_emergency_fund:
-            step_2 = self.get_monthly_contribution_to_employer_matching(verbose=verbose)
-        step_1 = self.get_monthly_emergency_fund_expendature(verbose=verbose)
-        if not self.prioritize_matching_over_emergency_fund:
-            step_2 = self.get_monthly_contribution_to_employer_matching(verbose=verbose)
-        step_3 = self.pay_off_high_interest_debt(verbose=verbose)
-        step_4 = self.get_IRA_contribution(verbose=verbose)
-        step_5 = self.allocate_savings_and_leisure_funds(verbose=verbose)
-        # return deductions spent
-        deductions_spent_df = pl.concat([step_2, step_4, step_5[["Excess 401K", "Excess IRA"]]], how = "horizontal")
-        deductions_spent_total = deductions_spent_df.sum_horizontal()[0]
-        # return non deduction spent
-        general_spending = pl.concat([step_0, step_1, step_3, step_5[["Excess Savings", "Excess Leisure"]]], how = "horizontal")
-        general_spending_total = general_spending.sum_horizontal()[0]
+        # Steps 0-5 in the order of the allocation policy
+        functions, matching_position, ira_position, savings_share = self.plan
+        outputs = [function(verbose=verbose) for function in functions]
+        post_deduction_savings = self.recalculate_net_income_with_deductions(outputs[matching_position], outputs[ira_position], outputs[-1],
+                                                                             verbose=verbose, savings_share=savings_share)
+        self.record_month(verbose=verbose)
+        
+    def recalculate_net_income_with_deductions(self, step_2, step_4, step_5, verbose=False, savings_share=0.5):
+        """Step 6: Recalculate net income with this month's pre-tax spending and split the difference to savings and leisure."""
+        recorder = self.recorder
+        # return deductions spent (summed left to right in column order)
+        deductions_spent_total = 0.0
+        for amount in [*step_2.values(), *step_4.values(), step_5["Excess 401K"], step_5["Excess IRA"]]:
+            deductions_spent_total+=amount
         # Sum up deductions and recalculate with pre-tax benefits properly distributed
         month_net_income_post_deductions = self.monthly_net_income(additional_deductions=deductions_spent_total*12) # NOTE: THIS ASSUMES CONSTANT CONTRIBUTION TO DEDUCTION FUNDS
         # Find leftover to distribute after recalculating net income with deductions
         month_net_income_pre_deductions = self.monthly_net_income(additional_deductions=0)
         leftover_to_distribute = month_net_income_post_deductions-month_net_income_pre_deductions
         if verbose:
-            print(f"After recalculating with deductions for ${deductions_spent_total} of spending distribute extra ${leftover_to_distribute} to savings and leisure equally.")
-        # Distribute leftover to savings and leisure at 50% split
-        general_spending = general_spending.with_columns([
-            (pl.lit(leftover_to_distribute)/2).alias("Post-Deduction Savings"),
-            (pl.lit(leftover_to_distribute)/2).alias("Post-Deduction Leisure")
-        ])
+            print(f"After recalculating with deductions for ${deductions_spent_total} of spending distribute extra ${leftover_to_distribute} to savings ({savings_share:.0%}) and leisure.")
+        # Distribute leftover to savings and leisure (50% split by default)
+        post_deduction_savings = leftover_to_distribute*savings_share
+        recorder.write("Spent", "Post-Deduction Savings", post_deduction_savings)
+        recorder.write("Spent", "Post-Deduction Leisure", leftover_to_distribute*(1 - savings_share))
         for bank_account in self.short_term_investments:
-            amount = (leftover_to_distribute*0.5)/len(self.short_term_investments)
+            amount = post_deduction_savings/len(self.short_term_investments)
             bank_account.contribute_funds(amount)
-        
-        # Return final df
-        this_month_df = pl.concat([base_df, deductions_spent_df, general_spending], how = "horizontal")
-        self.paycheck_only_spending_df_list.append(pl.concat([base_df, general_spending], how = "horizontal"))
-        self.spent_df_list.append(this_month_df)
-        all_balances_dict = dict({"Years" : self.years_past})
-        simplified_df_this_month = pl.DataFrame({"Savings" : step_1.sum_horizontal()[0] + step_5["Excess Savings"][0] + general_spending["Post-Deduction Savings"][0],
-                                                 "Retirement/Health" : step_2.sum_horizontal()[0] + step_4.sum_horizontal()[0] + step_5[["Excess 401K", "Excess IRA"]].sum_horizontal()[0],
-                                                 "Loans" : step_3.sum_horizontal()[0],
-                                                 "Leisure" : step_0["Minimum Leisure"][0] + step_5["Excess Leisure"][0] + general_spending["Post-Deduction Leisure"][0],
-                                                 "Need" : step_0.drop("Minimum Leisure").sum_horizontal()[0]})
-        self.simplified_df_list.append(pl.concat([base_df, simplified_df_this_month], how = "horizontal"))
-        for account_types in [self.short_term_investments, self.debts, self.employer_matched_investments, 
-                              self.employer_flat_rate_investments, self.other_ira_investments, self.other_investments]:
-            for account in account_types:
-                all_balances_dict.update({account.type : account.outstanding_balance})
-        self.records_df_list.append(pl.DataFrame(all_balances_dict))
+        return post_deduction_savings
+    
+    def record_month(self, verbose=False):
+        """Record balances and move on to the next row (the spending steps already wrote theirs)."""
+        recorder = self.recorder
+        recorder.write("Accounts", "Years", self.years_past)
+        recorder.write_dict("Accounts", self.all_balances_dict)
         if verbose:
-            print(this_month_df)
-        return this_month_df
+            print(dict({column : values[recorder.row] for column, values in recorder.columns["Spent"].items()}))
+        recorder.next_row()
+    
+    ### Fast Forward
+    
+    def steady_state_months(self, horizon):
+        """Number of upcoming months (up to horizon) that would repeat the last recorded month's decisions.
+        
+        Requires the last two recorded months to have spent exactly the same. Balances are then projected in closed
+        form (geometric growth plus constant monthly contributions) and the balance dependent decisions (emergency fund
+        and debt payments) are re-checked on them. Returns the steady months and the projected end of month balances."""
+        recorder = self.recorder
+        if recorder is None or recorder.row < 2:
+            return 0, None
+        # Stop at the next event and wait for two recorded months after the last one
+        month = self.current_month
+        horizon = min(horizon, self.timeline.next_month - month)
+        if horizon < 1 or month - self.timeline.last_fired_month < 2:
+            return 0, None
+        row = recorder.row
+        spent = recorder.columns["Spent"]
+        for column, values in spent.items():
+            if column != "Years" and values[row-1] != values[row-2]:
+                return 0, None
+        accounts = self.all_accounts
+        if len(set(account.type for account in accounts)) != len(accounts):
+            return 0, None
+        # Closed form balances b_t = b_0*g^t + c*(g^t-1)/(g-1) with last month's contributions c
+        growth = self.ledger.growth[self.account_slots]
+        previous = np.array([recorder.columns["Accounts"][account.type][row-2] for account in accounts])
+        current = self.ledger.balances[self.account_slots]
+        contributions = current - previous*growth
+        months = np.arange(1, horizon+1, dtype=np.float64)[:, None]
+        compounded = growth**months
+        with np.errstate(divide="ignore", invalid="ignore"):
+            annuity = np.where(growth == 1, months, (compounded - 1)/(growth - 1))
+        balances = current*compounded + contributions*annuity
+        matured = np.vstack([current, balances[:-1]])*growth # Balances after Step -1 of each month
+        
+        # Emergency fund and debt decisions on the projected balances, in the order of the allocation policy
+        leftover = 0.0 + self.monthly_net_income(additional_deductions=0)
+        for need_object in self.monthly_needs.values():
+            leftover-=need_object.monthly_necessity_costs
+        steady = np.ones(horizon, dtype=bool)
+        for step, settings in self.allocation_policy.steps[1:-1]:
+            if step == "matching":
+                for investment_object in self.employer_matched_investments:
+                    leftover-=spent[investment_object.type][row-1]
+            elif step == "ira":
+                for investment_object in self.other_ira_investments:
+                    leftover-=spent[investment_object.type][row-1]
+            elif step == "emergency_fund":
+                months, high_interest_rate = settings
+                short_term_savings_total = matured[:, :len(self.short_term_investments)].sum(axis=1)
+                need = self.month_constants["Monthly Need Expendature"]
+                highest_interest_debt = self.month_constants["Highest Interest Debt"]
+                needed = np.where(short_term_savings_total >= need*months, 0.0, np.minimum(leftover, need*months - short_term_savings_total))
+                needed = np.where((highest_interest_debt >= high_interest_rate) & (short_term_savings_total >= need), 0.0, needed)
+                needed = np.where((short_term_savings_total < need) & (highest_interest_debt > high_interest_rate),
+                                  np.minimum(leftover, need - short_term_savings_total), needed)
+                steady &= needed == spent["Emergency Fund"][row-1]
+                leftover-=spent["Emergency Fund"][row-1]
+            elif step == "debts":
+                possible_contributed = min(self.maximum_monthly_loan_payment, leftover)
+                for debt_index, debt in enumerate(self.debts):
+                    feasible_contribution_amount = np.minimum(possible_contributed, matured[:, len(self.short_term_investments) + debt_index])
+                    steady &= feasible_contribution_amount == spent[debt.type][row-1]
+                    possible_contributed = possible_contributed - feasible_contribution_amount
+                    leftover-=spent[debt.type][row-1]
+        steady_months = horizon if steady.all() else int(np.argmin(steady))
+        return steady_months, balances
+    
+    def fast_forward(self, months, balances):
+        """Advance steady months at once: repeat last month's spending rows and jump balances to their closed form values."""
+        recorder = self.recorder
+        recorder.reserve(months)
+        row = recorder.row
+        years = np.cumsum(np.concatenate([[self.years_past], np.full(months, 1/12)]))
+        for column, values in recorder.columns["Spent"].items():
+            values[row:row+months] = years[:-1] if column == "Years" else values[row-1]
+        recorder.columns["Accounts"]["Years"][row:row+months] = years[1:]
+        for account_index, account_type in enumerate(self.account_types):
+            recorder.columns["Accounts"][account_type][row:row+months] = balances[:months, account_index]
+        self.ledger.balances[self.account_slots] = balances[months-1]
+        self.ledger.months_since_start[:self.ledger.size]+=months
+        recorder.row+=months
+        self.years_past = float(years[-1])
     
-    def simulate_n_years(self, years, verbose = False):
+    def simulate_n_years(self, years, verbose = False, fast_forward = False):
+        """Simulate and return the output tables.
+        
+        fast_forward: jump over stretches where every month makes the same decisions (balances in closed form instead of
+        stepped, so they can differ from stepping in the last digits). Month counts are kept in simulated_months."""
         months = years*12
-        for month in range(months):
+        if self.recorder is None:
+            self.recorder = MonthlyRecorder(self.recorder_layout(), capacity=months)
+        self.recorder.reserve(months)
+        for advanced in self._advance_months(months, verbose=verbose, fast_forward=fast_forward):
+            pass
+        return self.results
+    
+    def stream_n_years(self, years, chunk_months = 12, verbose = False, fast_forward = False):
+        """Simulate like simulate_n_years but yield the output tables of every chunk_months months as they are done.
+        
+        Only the current chunk is held in memory, so use this for long horizons or many profiles (see sinks.py to write
+        the chunks to disk). chunk_months=1 yields every month on its own. Rows recorded before are not yielded."""
+        if chunk_months < 1:
+            raise ValueError("chunk_months must be at least 1.")
+        if self.recorder is None:
+            self.recorder = MonthlyRecorder(self.recorder_layout(), capacity=chunk_months)
+        self.recorder.discard()
+        for advanced in self._advance_months(years*12, verbose=verbose, fast_forward=fast_forward, chunk_months=chunk_months):
+            if self.recorder.row - self.recorder.start == chunk_months:
+                yield self.results
+                self.recorder.discard()
+        if self.recorder.row > self.recorder.start:
+            yield self.results
+            self.recorder.discard()
+    
+    def _advance_months(self, months, verbose = False, fast_forward = False, chunk_months = None):
+        """Advance months one step (a month or a fast forwarded stretch) at a time, yielding the months of each step.
+        
+        Fast forwarded stretches never cross a multiple of chunk_months."""
+        self.simulated_months = dict({"Analytic" : 0, "Stepped" : 0})
+        month = 0
+        steps_since_fast_forward = 0
+        while month < months:
+            if fast_forward and steps_since_fast_forward >= 2:
+                horizon = months - month if chunk_months is None else min(months - month, chunk_months - month % chunk_months)
+                steady_months, balances = self.steady_state_months(horizon)
+                if steady_months > 0:
+                    self.fast_forward(steady_months, balances)
+                    if verbose:
+                        print(f"Fast forward {steady_months} steady months.")
+                    month+=steady_months
+                    self.simulated_months["Analytic"]+=steady_months
+                    steps_since_fast_forward = 0
+                    yield steady_months
+                    continue
             self.advance_one_month(verbose=verbose)
-        return dict({"Spent" : pl.concat(self.spent_df_list, how = "vertical"), 
-                     "Accounts" : pl.concat(self.records_df_list, how = "vertical"),
-                     "Paycheck Only Spending" : pl.concat(self.paycheck_only_spending_df_list, how = "vertical"),
-                     "Simplified Spending" : pl.concat(self.simplified_df_list, how = "vertical"),})
+            month+=1
+            self.simulated_months["Stepped"]+=1
+            steps_since_fast_forward+=1
+            yield 1
+    
+    @property
+    def results(self) -> ResultTables:
+        """Output tables of the recorded months, built only when a table is looked at (see ResultTables)."""
+        return derived_tables(self.recorder.scan("Spent"), self.recorder.scan("Accounts"), self.paycheck_only_spending_columns,
+                              self.recorded_columns("Matched"), self.recorded_columns("IRA"), self.recorded_columns("Debt"),
+                              self.recorded_columns("Need"))
+    
+    ### Events
+    
+    @property
+    def current_month(self) -> int:
+        """Months simulated so far, the month the next advance_one_month simulates."""
+        return int(round(self.years_past*12))
+    
+    def schedule(self, *events : TimelineEvent):
+        """Schedule raises, job changes, expenses, ... (see timeline.py) to happen at the start of their month."""
+        for event in events:
+            if event.month < self.current_month:
+                raise ValueError(f"{event} is scheduled before the current month {self.current_month}.")
+        for event in events:
+            self.timeline.push(event)
+    
+    def apply_due_events(self, verbose = False):
+        for event in self.timeline.pop_due(self.current_month):
+            if verbose:
+                print(f"Event: {event}")
+            event.apply(self)
+    
+    def update_jobs(self, changes : dict):
+        """Replace jobs by name ({name : EmployerBenefits}, None to leave a job)."""
+        employer_benefits = dict(self.employer_benefits)
+        for name, job in changes.items():
+            if job is None:
+                employer_benefits.pop(name, None)
+            else:
+                employer_benefits[name] = job
+        matching = set()
+        for job in employer_benefits.values():
+            matching.update(job.monthly_contributions_to_investments)
+        for investment_object in self.employer_matched_investments + self.employer_flat_rate_investments:
+            if investment_object.type not in matching:
+                raise ValueError(f"No job contributes to {investment_object.type} any more, close it first.")
+        self.employer_benefits = employer_benefits
+    
+    def update_needs(self, changes : dict):
+        """Replace MonthlyNeededExpenses by name, new costs get their own spending columns."""
+        monthly_needs = dict(self.monthly_needs)
+        monthly_needs.update(changes)
+        self.monthly_needs = monthly_needs
+        if self.recorder is not None:
+            self.recorder.extend(self.recorder_layout())
+    
+    def open_account(self, name : str, account : LedgerAccount, category : str):
+        """Add a Debt (category "Debts") or an Investment to an investment category, recorded from this month on."""
+        if category != "Debts" and category not in self.investments:
+            raise ValueError(f"Unknown category {category}, choose Debts or one of {', '.join(self.investments)}.")
+        if isinstance(account, Debt) != (category == "Debts"):
+            raise ValueError(f"{name} must be a Debt to open it under Debts and an Investment otherwise.")
+        if account.type in self.account_types or name in self.debts_dict or name in self.flattened_investment_dict:
+            raise ValueError(f"There already is an account named {name} or of type {account.type}.")
+        if category == "Debts":
+            self.debts_dict = dict({**self.debts_dict, name : account})
+        else:
+            self.investments = dict({**self.investments, category : dict({**self.investments[category], name : account})})
+        self.sort_accounts()
+        if self.recorder is not None:
+            self.recorder.extend(self.recorder_layout())
+    
+    def close_account(self, name : str, transfer_to : str = None):
+        """Remove a debt or investment by name, moving an investment's balance to the transfer_to investment if given.
+        
+        A debt's outstanding balance is written off. Its columns stay in the output tables, at zero from this month on."""
+        categories = dict({"Debts" : self.debts_dict, **self.investments})
+        category = next((category for category, accounts in categories.items() if name in accounts), None)
+        if category is None:
+            raise ValueError(f"No account {name} to close.")
+        account = categories[category][name]
+        if (category, name) in [("Employer Matched Retirement", "401K"), ("IRA", "IRA")] or \
+                (category == "Short Term" and len(self.short_term_investments) == 1):
+            raise ValueError(f"{name} is needed by the monthly allocation and can not be closed.")
+        if transfer_to is not None:
+            if category == "Debts" or transfer_to not in self.flattened_investment_dict:
+                raise ValueError(f"Can only transfer the balance of an investment to another investment, not {transfer_to}.")
+            self.flattened_investment_dict[transfer_to].contribute_funds(account.outstanding_balance)
+        account.outstanding_balance = 0.0 # Stays zero in the ledger, whatever its rate
+        if category == "Debts":
+            self.debts_dict = dict({other : debt for other, debt in self.debts_dict.items() if other != name})
+        else:
+            self.investments = dict({**self.investments, category : dict({other : investment for other, investment in self.investments[category].items()
+                                                                         if other != name})})
+        self.sort_accounts()
+    
+    def add_to_account(self, amount : float, account : str = None):
+        """Add (or take out, if negative) a one-off amount to an investment, the first short term account by default."""
+        if account is None:
+            self.short_term_investments[0].contribute_funds(amount)
+        elif account in self.flattened_investment_dict:
+            self.flattened_investment_dict[account].contribute_funds(amount)
+        else:
+            raise ValueError(f"No investment {account}.")
+    
+    ### Snapshots
+    
+    def snapshot(self) -> ProfileSnapshot:
+        """Checkpoint of the running state, cheap enough to take every month."""
+        return ProfileSnapshot(self)
+    
+    def restore(self, snapshot : ProfileSnapshot):
+        """Return to a snapshot of this profile (or of the profile it was forked from).
+        
+        Accounts opened after the snapshot are dropped and events after it are pending again."""
+        if snapshot.lineage is not self.lineage or len(snapshot.balances) > self.ledger.size:
+            raise ValueError("Snapshot was taken from a different profile.")
+        self.ledger.size = len(snapshot.balances)
+        del self.accounts_by_slot[self.ledger.size:]
+        self.ledger.balances[:self.ledger.size] = snapshot.balances
+        self.ledger.months_since_start[:self.ledger.size] = snapshot.months_since_start
+        self.years_past = snapshot.years_past
+        self.current_month_leftover_net_income = snapshot.current_month_leftover_net_income
+        self.matching_amounts_left = snapshot.matching_amounts_left.copy()
+        self.spent_401 = snapshot.spent_401
+        self.spent_IRA = snapshot.spent_IRA
+        self.recorder = None if snapshot.recorder is None else snapshot.recorder.share()
+        self.employer_benefits = snapshot.employer_benefits
+        self.monthly_needs = snapshot.monthly_needs
+        if snapshot.structure is not self.structure:
+            self.debts_dict = dict({name : self.accounts_by_slot[slot] for name, slot in snapshot.structure["Debts"].items()})
+            self.investments = dict({category : dict({name : self.accounts_by_slot[slot] for name, slot in slots.items()})
+                                     for category, slots in snapshot.structure.items() if category != "Debts"})
+            self.sort_accounts()
+            self.structure = snapshot.structure
+        self.timeline.rewind(self.current_month)
+    
+    def __setstate__(self, state):
+        """Unpickled (i.e. in a worker process): claim the ledger, its accounts came along with it."""
+        self.__dict__.update(state)
+        self.ledger.owner = weakref.ref(self)
+
+    def fork(self, snapshot : ProfileSnapshot = None) -> "FinancialProfile":
+        """Independent copy of the profile (at a snapshot if given) to simulate an alternative future.
+        
+        Only the debts, investments and scheduled events are copied, the needs, jobs and tax settings are shared with
+        this profile: replace them on the fork (i.e. fork.employer_benefits = dict(...), or schedule an event) rather
+        than changing them in place."""
+        forked = copy.copy(self)
+        forked.ledger = self.ledger.copy()
+        forked.ledger.owner = weakref.ref(forked)
+        forked.accounts_by_slot = [copy.copy(account) for account in self.accounts_by_slot]
+        copies = dict({id(account) : account_copy for account, account_copy in zip(self.accounts_by_slot, forked.accounts_by_slot)})
+        for account in forked.accounts_by_slot:
+            account.ledger = forked.ledger
+        forked.debts_dict = dict({name : copies[id(debt)] for name, debt in self.debts_dict.items()})
+        forked.debts = [copies[id(debt)] for debt in self.debts]
+        forked.short_term_investments = [copies[id(account)] for account in self.short_term_investments]
+        forked.employer_matched_investments = [copies[id(account)] for account in self.employer_matched_investments]
+        forked.other_ira_investments = [copies[id(account)] for account in self.other_ira_investments]
+        forked.other_investments = [copies[id(account)] for account in self.other_investments]
+        forked.employer_flat_rate_investments = [copies[id(account)] for account in self.employer_flat_rate_investments]
+        forked.investments = dict({category : dict({name : copies[id(account)] for name, account in category_dict.items()})
+                                   for category, category_dict in self.investments.items()})
+        forked.flattened_investment_dict = flatten_investment_dict(forked.investments)
+        forked.matching_amounts_left = self.matching_amounts_left.copy()
+        forked.recorder = None if self.recorder is None else self.recorder.share()
+        forked.column_kinds = dict(self.column_kinds)
+        forked._plan_sources = None # The plan holds methods bound to this profile
+        forked.timeline = self.timeline.copy()
+        if self.instrumentation is not None:
+            self.instrumentation.detach(forked)
+        if snapshot is not None:
+            forked.restore(snapshot)
+        return forked
+    
+    ### Instrumentation
+    
+    def instrument(self, hooks = ()) -> StepInstrumentation:
+        """Time every waterfall step until the returned StepInstrumentation is detached, i.e.
+        
+        with profile.instrument() as instrumentation:
+            profile.simulate_n_years(10)
+        instrumentation.table()
+        
+        hooks: callables hook(step name, seconds) run after every timed step."""
+        instrumentation = StepInstrumentation(hooks)
+        instrumentation.attach(self)
+        return instrumentation
     
     def reset_profile(self):
-        pass
+        """Back to the state the profile was constructed in, with nothing recorded."""
+        self.restore(self.initial_snapshot)
     
     
\ No newline at end of file
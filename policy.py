@@ -0,0 +1,112 @@
+"""Allocation policies: the order and settings of the monthly waterfall steps.
+
+A policy is an ordered list of steps, each a step name or {"step" : name, setting : value, ...}:
+
+needs            Spend the monthly needs (always first)
+emergency_fund   Build an emergency fund of `months` months of needs, only one month while a debt's rate is at
+                 least high_interest_rate (settings: months = 6, high_interest_rate = 0.15)
+matching         Contribute what the employers match
+debts            Pay debts, highest rate first, up to maximum_monthly_loan_payment
+ira              Contribute up to yearly_limit a year to the IRAs (setting: yearly_limit = 7000)
+leftover         Excess 401K and IRA, then split the rest between savings and leisure (always last)
+
+post_deduction_savings_share is the part of the tax saved on pre-tax contributions that goes to savings, the rest is
+leisure. Policies are validated once when created and compiled into a fixed plan by each engine (FinancialProfile
+and FinancialProfileBatch), so the monthly loop only calls methods with settings bound in advance."""
+
+# Step name : {setting : default}, settings are passed to the step methods in this order
+STEP_SETTINGS = dict({"needs" : dict(),
+                      "emergency_fund" : dict({"months" : 6, "high_interest_rate" : 0.15}),
+                      "matching" : dict(),
+                      "debts" : dict(),
+                      "ira" : dict({"yearly_limit" : 7000}),
+                      "leftover" : dict()})
+STEP_NAMES = list(STEP_SETTINGS)
+# Step name : method running it, the same in FinancialProfile and FinancialProfileBatch
+STEP_METHODS = dict({"needs" : "get_monthly_spend_on_needs",
+                     "emergency_fund" : "get_monthly_emergency_fund_expendature",
+                     "matching" : "get_monthly_contribution_to_employer_matching",
+                     "debts" : "pay_off_high_interest_debt",
+                     "ira" : "get_IRA_contribution",
+                     "leftover" : "allocate_savings_and_leisure_funds"})
+
+def check_setting(step : str, setting : str, value) -> str:
+    """Problem with a step setting, None if it is fine."""
+    if not isinstance(value, (int, float)) or isinstance(value, bool) or value != value:
+        return f"{step}.{setting} must be a number"
+    if setting == "high_interest_rate" and not 0 <= value <= 1:
+        return f"{step}.{setting} must be between 0 and 1"
+    if value < 0:
+        return f"{step}.{setting} must not be negative"
+    return None
+
+def parse_steps(steps : list, post_deduction_savings_share = 0.5):
+    """((step name, settings tuple), ...) of a list of steps and the problems with them."""
+    problems = []
+    parsed = []
+    for step in steps:
+        if not isinstance(step, (str, dict)):
+            problems.append(f"step {step} must be a step name or a table with a step name and settings")
+            continue
+        step = dict({"step" : step}) if isinstance(step, str) else dict(step)
+        name = step.pop("step", None)
+        if name not in STEP_SETTINGS:
+            problems.append(f"unknown step {name}, choose from {', '.join(STEP_NAMES)}")
+            continue
+        for setting, value in step.items():
+            if setting not in STEP_SETTINGS[name]:
+                problems.append(f"{name} has no setting {setting}")
+            elif check_setting(name, setting, value):
+                problems.append(check_setting(name, setting, value))
+        parsed.append((name, tuple(step.get(setting, default) for setting, default in STEP_SETTINGS[name].items())))
+    order = [name for name, settings in parsed]
+    for name in STEP_NAMES:
+        if order.count(name) != 1:
+            problems.append(f"step {name} must appear exactly once")
+    if order and (order[0] != "needs" or order[-1] != "leftover"):
+        problems.append("needs must be the first step and leftover the last")
+    share_problem = check_setting("policy", "post_deduction_savings_share", post_deduction_savings_share)
+    if share_problem or not 0 <= post_deduction_savings_share <= 1:
+        problems.append("post_deduction_savings_share must be a number between 0 and 1")
+    return tuple(parsed), problems
+
+def spec_problems(spec : dict) -> list:
+    """Problems with a policy spec ({"steps" : [...], "post_deduction_savings_share" : ...}), empty if it is fine."""
+    if not isinstance(spec, dict) or not isinstance(spec.get("steps"), list):
+        return ["needs a list of steps"]
+    problems = [f"has no setting {key}" for key in spec if key not in ["steps", "post_deduction_savings_share"]]
+    return problems + parse_steps(spec["steps"], spec.get("post_deduction_savings_share", 0.5))[1]
+
+class AllocationPolicy:
+    """Validated order and settings of the waterfall steps (see the module docstring)."""
+
+    def __init__(self, steps : list, post_deduction_savings_share = 0.5):
+        parsed, problems = parse_steps(steps, post_deduction_savings_share)
+        if problems:
+            raise ValueError("Invalid allocation policy:\n  " + "\n  ".join(problems))
+        self.steps = parsed # ((step name, settings tuple), ...) in order
+        self.order = tuple(name for name, settings in parsed)
+        self.post_deduction_savings_share = post_deduction_savings_share
+
+    def settings(self, step : str) -> dict:
+        return dict(zip(STEP_SETTINGS[step], dict(self.steps)[step]))
+
+    def to_spec(self) -> dict:
+        """Plain dict version, as in profile files ({"steps" : [...], "post_deduction_savings_share" : ...})."""
+        return dict({"steps" : [dict({"step" : name, **dict(zip(STEP_SETTINGS[name], settings))}) if settings else name
+                                for name, settings in self.steps],
+                     "post_deduction_savings_share" : self.post_deduction_savings_share})
+
+    @classmethod
+    def from_spec(cls, spec : dict) -> "AllocationPolicy":
+        problems = spec_problems(spec)
+        if problems:
+            raise ValueError("Invalid allocation policy:\n  " + "\n  ".join(problems))
+        return cls(spec["steps"], spec.get("post_deduction_savings_share", 0.5))
+
+    def __repr__(self):
+        return f"AllocationPolicy({self.to_spec()})"
+
+# The waterfall as it has always run, by prioritize_matching_over_emergency_fund
+DEFAULT_POLICIES = dict({True : AllocationPolicy(["needs", "matching", "emergency_fund", "debts", "ira", "leftover"]),
+                         False : AllocationPolicy(["needs", "emergency_fund", "matching", "debts", "ira", "leftover"])})
@@ -0,0 +1,174 @@
+"""Profile files: a TOML or JSON version of selections.py, loaded into a profile spec (see profile_spec.py).
+
+Loading and validating a file only needs the standard library, numpy/polars are imported once a profile is built.
+See examples/profile.toml for the format, [investments] may leave out categories without accounts."""
+import json
+import math
+import os
+from policy import spec_problems
+
+COMPOUNDING = ["daily", "monthly", "semi-annually", "annually"]
+INVESTMENT_CATEGORIES = ["Short Term", "Employer Matched Retirement", "Employer Flat Rate Retirement", "IRA", "Other"]
+ACCOUNT_FIELDS = dict({"initial_outstanding_balance" : "number", "interest_rate" : "rate", "compounding" : "compounding", "type" : "string"})
+INSURANCE_FIELDS = dict({"monthly_premium" : "number", "type" : "string"})
+JOB_FIELDS = dict({"salary" : "number", "retirement_matching" : "table", "monthly_flat_rate_contributions" : "table",
+                   "company_insurances" : "list"})
+NEED_FIELDS = dict({"rent" : "number", "food" : "number", "electric" : "number", "internet" : "number",
+                    "personal_insurance" : "list", "minimum_excess_expendature" : "number"})
+PROFILE_FIELDS = dict({"maximum_monthly_loan_payment" : "number", "federal_tax_brackets" : "brackets", "standard_deduction" : "number",
+                       "fica_rate" : "rate", "state_tax_rate" : "rate", "max_401K_legal" : "number", "max_IRA_legal" : "number",
+                       "prioritize_matching_over_emergency_fund" : "boolean"})
+OPTIONAL_PROFILE_FIELDS = dict({"savings_leftover_percent" : "rate", "leisure_leftover_percent" : "rate", "allocation_policy" : "table"})
+
+def read_profile_file(path : str) -> dict:
+    """Raw contents of a .toml or .json profile file."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".toml":
+        import tomllib
+        with open(path, "rb") as file:
+            return tomllib.load(file)
+    if extension == ".json":
+        with open(path) as file:
+            return json.load(file)
+    raise ValueError(f"Unknown profile file type {extension}, use .toml or .json.")
+
+def write_profile_file(spec : dict, path : str):
+    """Write a spec as a JSON profile file."""
+    with open(path, "w") as file:
+        json.dump(spec, file, indent=2)
+
+def check_value(kind, value) -> str:
+    """Problem with a value of a field kind, None if it is fine."""
+    is_number = isinstance(value, (int, float)) and not isinstance(value, bool)
+    if kind == "number":
+        return None if is_number and not math.isnan(value) else "must be a number"
+    if kind == "rate":
+        return None if is_number and 0 <= value <= 1 else "must be a number between 0 and 1"
+    if kind == "string":
+        return None if isinstance(value, str) else "must be a string"
+    if kind == "boolean":
+        return None if isinstance(value, bool) else "must be true or false"
+    if kind == "table":
+        return None if isinstance(value, dict) else "must be a table"
+    if kind == "list":
+        return None if isinstance(value, list) else "must be a list"
+    if kind == "compounding":
+        return None if value in COMPOUNDING else f"must be one of {', '.join(COMPOUNDING)}"
+    if kind == "brackets":
+        if not isinstance(value, list) or len(value) == 0:
+            return "must be a list of [width, rate] pairs"
+        for bracket in value:
+            if not isinstance(bracket, (list, tuple)) or len(bracket) != 2 or check_value("number", bracket[0]) or check_value("rate", bracket[1]):
+                return "must be a list of [width, rate] pairs with rates between 0 and 1"
+            if bracket[0] <= 0:
+                return "bracket widths must be positive"
+        return None
+    raise ValueError(f"Unknown field kind {kind}.")
+
+def check_fields(section : dict, fields : dict, path : str, optional = dict()) -> list:
+    """Problems with the fields of one table (missing, unknown or wrong kind)."""
+    if not isinstance(section, dict):
+        return [f"{path} must be a table"]
+    problems = [f"{path}.{field} is missing" for field in fields if field not in section]
+    for field, value in section.items():
+        kind = fields.get(field, optional.get(field))
+        if kind is None:
+            problems.append(f"{path}.{field} is not a known setting")
+        elif check_value(kind, value):
+            problems.append(f"{path}.{field} {check_value(kind, value)}")
+    return problems
+
+table_or_empty = lambda value: value if isinstance(value, dict) else dict()
+list_or_empty = lambda value: value if isinstance(value, list) else []
+
+def validate_spec(spec : dict) -> dict:
+    """Check a raw profile file and return it as a spec, raises ValueError listing every problem."""
+    if not isinstance(spec, dict):
+        raise ValueError("A profile must be a table of settings.")
+    spec = dict(spec)
+    spec["investments"] = dict(spec.get("investments", dict()))
+    problems = []
+    for section in ["debts", "insurances", "employer_benefits", "monthly_needs"]:
+        spec.setdefault(section, dict())
+        if not isinstance(spec[section], dict):
+            problems.append(f"{section} must be a table")
+            spec[section] = dict()
+    for category in list(spec["investments"]):
+        if category not in INVESTMENT_CATEGORIES:
+            problems.append(f"investments.{category} is not one of {', '.join(INVESTMENT_CATEGORIES)}")
+    for category in INVESTMENT_CATEGORIES:
+        spec["investments"].setdefault(category, dict())
+
+    accounts = [(f"debts.{name}", debt) for name, debt in spec["debts"].items()]
+    accounts += [(f"investments.{category}.{name}", investment) for category in INVESTMENT_CATEGORIES
+                 for name, investment in spec["investments"][category].items()]
+    for path, account in accounts:
+        problems += check_fields(account, ACCOUNT_FIELDS, path)
+    types = [account.get("type") for path, account in accounts if isinstance(account, dict)]
+    for account_type in set(types):
+        if types.count(account_type) > 1:
+            problems.append(f"account type {account_type} is used by more than one debt or investment")
+    for name, insurance in spec["insurances"].items():
+        problems += check_fields(insurance, INSURANCE_FIELDS, f"insurances.{name}")
+
+    matched_types = [investment.get("type") for investment in spec["investments"]["Employer Matched Retirement"].values() if isinstance(investment, dict)]
+    flat_rate_types = [investment.get("type") for investment in spec["investments"]["Employer Flat Rate Retirement"].values() if isinstance(investment, dict)]
+    for name, job in spec["employer_benefits"].items():
+        path = f"employer_benefits.{name}"
+        problems += check_fields(job, JOB_FIELDS, path)
+        if not isinstance(job, dict):
+            continue
+        for fund_type, rate in table_or_empty(job.get("retirement_matching")).items():
+            if fund_type not in matched_types:
+                problems.append(f"{path}.retirement_matching.{fund_type} is not the type of an Employer Matched Retirement investment")
+            elif check_value("rate", rate):
+                problems.append(f"{path}.retirement_matching.{fund_type} {check_value('rate', rate)}")
+        for fund_type, amount in table_or_empty(job.get("monthly_flat_rate_contributions")).items():
+            if fund_type not in flat_rate_types:
+                problems.append(f"{path}.monthly_flat_rate_contributions.{fund_type} is not the type of an Employer Flat Rate Retirement investment")
+            elif check_value("number", amount):
+                problems.append(f"{path}.monthly_flat_rate_contributions.{fund_type} {check_value('number', amount)}")
+        for insurance in list_or_empty(job.get("company_insurances")):
+            if insurance not in spec["insurances"]:
+                problems.append(f"{path}.company_insurances has unknown insurance {insurance}")
+    for name, need in spec["monthly_needs"].items():
+        path = f"monthly_needs.{name}"
+        problems += check_fields(need, NEED_FIELDS, path)
+        if isinstance(need, dict):
+            for insurance in list_or_empty(need.get("personal_insurance")):
+                if insurance not in spec["insurances"]:
+                    problems.append(f"{path}.personal_insurance has unknown insurance {insurance}")
+    if len(spec["investments"]["Short Term"]) == 0:
+        problems.append("investments.Short Term needs at least one account")
+    # The leftover step puts excess contributions into these two accounts by name
+    for category, name in [("Employer Matched Retirement", "401K"), ("IRA", "IRA")]:
+        if name not in spec["investments"][category]:
+            problems.append(f"investments.{category} needs an account named {name}")
+    # Every matched and flat rate fund is looked up in the jobs' contributions each month
+    jobs = [job for job in spec["employer_benefits"].values() if isinstance(job, dict)]
+    matched_by_jobs = [fund_type for job in jobs for fund_type in table_or_empty(job.get("retirement_matching"))]
+    flat_rate_by_jobs = [fund_type for job in jobs for fund_type in table_or_empty(job.get("monthly_flat_rate_contributions"))]
+    for fund_type in matched_types:
+        if fund_type not in matched_by_jobs:
+            problems.append(f"Employer Matched Retirement investment {fund_type} is not in any job's retirement_matching")
+    for fund_type in flat_rate_types:
+        if fund_type not in flat_rate_by_jobs:
+            problems.append(f"Employer Flat Rate Retirement investment {fund_type} is not in any job's monthly_flat_rate_contributions")
+
+    settings = dict({field : value for field, value in spec.items()
+                     if field not in ["debts", "insurances", "investments", "employer_benefits", "monthly_needs"]})
+    problems += check_fields(settings, PROFILE_FIELDS, "profile", optional=OPTIONAL_PROFILE_FIELDS)
+    if isinstance(spec.get("allocation_policy"), dict):
+        problems += [f"profile.allocation_policy {problem}" for problem in spec_problems(spec["allocation_policy"])]
+    if problems:
+        raise ValueError("Invalid profile:\n  " + "\n  ".join(problems))
+    return spec
+
+def load_profile_spec(path : str) -> dict:
+    """Validated spec of a profile file, ready for profile_spec.profile_from_spec."""
+    return validate_spec(read_profile_file(path))
+
+def load_profile(path : str):
+    """FinancialProfile built from a profile file."""
+    from profile_spec import profile_from_spec
+    return profile_from_spec(load_profile_spec(path))
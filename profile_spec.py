@@ -0,0 +1,80 @@
+"""Plain dict (JSON-like) description of a FinancialProfile, cheap to copy and pickle.
+
+{"debts" : {name : Debt arguments},
+ "insurances" : {name : Insurance arguments},
+ "investments" : {category : {name : Investment arguments}},
+ "employer_benefits" : {name : EmployerBenefits arguments without insurances},
+ "monthly_needs" : {name : MonthlyNeededExpenses arguments without insurances},
+ "allocation_policy" : {"steps" : [...], "post_deduction_savings_share" : ...} (optional, see policy.py),
+ ...every other FinancialProfile argument (federal_tax_brackets as [width, rate] pairs)}"""
+import copy
+from objects import MonthlyNeededExpenses, Debt, Insurance, Investment, EmployerBenefits, FinancialProfile
+from policy import AllocationPolicy
+
+def profile_to_spec(profile : FinancialProfile) -> dict:
+    """Spec of a profile at its current balances."""
+    insurances = dict()
+    for holder in list(profile.monthly_needs.values()) + list(profile.employer_benefits.values()):
+        insurances.update(holder.insurances)
+    account_spec = lambda account: dict({"initial_outstanding_balance" : float(account.outstanding_balance),
+                                         "interest_rate" : float(account.interest_rate),
+                                         "compounding" : account.compounding,
+                                         "type" : account.type})
+    spec = dict({"debts" : dict({name : account_spec(debt) for name, debt in profile.debts_dict.items()}),
+                 "insurances" : dict({name : dict({"monthly_premium" : insurance.monthly_premium, "type" : insurance.type})
+                                      for name, insurance in insurances.items()}),
+                 "investments" : dict({category : dict({name : account_spec(investment) for name, investment in category_dict.items()})
+                                       for category, category_dict in profile.investments.items()}),
+                 "employer_benefits" : dict({name : dict({"salary" : float(job.salary),
+                                                          "retirement_matching" : dict(job.retirement_matching),
+                                                          "monthly_flat_rate_contributions" : dict(job.monthly_flat_rate_contributions),
+                                                          "company_insurances" : list(job.company_insurances)})
+                                             for name, job in profile.employer_benefits.items()}),
+                 "monthly_needs" : dict({name : dict({"rent" : need.rent, "food" : need.food, "electric" : need.electric,
+                                                      "internet" : need.internet, "personal_insurance" : list(need.personal_insurance),
+                                                      "minimum_excess_expendature" : need.minimum_excess_expendature})
+                                         for name, need in profile.monthly_needs.items()}),
+                 "maximum_monthly_loan_payment" : profile.maximum_monthly_loan_payment,
+                 "federal_tax_brackets" : [[bracket_width, bracket_rate] for bracket_width, bracket_rate in profile.federal_tax_brackets],
+                 "standard_deduction" : profile.standard_deduction,
+                 "fica_rate" : profile.fica_rate,
+                 "state_tax_rate" : profile.state_tax_rate,
+                 "max_401K_legal" : profile.max_401K_legal,
+                 "max_IRA_legal" : profile.max_IRA_legal,
+                 "prioritize_matching_over_emergency_fund" : profile.prioritize_matching_over_emergency_fund,
+                 "savings_leftover_percent" : profile.savings_leftover_percent,
+                 "leisure_leftover_percent" : profile.leisure_leftover_percent})
+    if profile.policy is not None:
+        spec["allocation_policy"] = profile.policy.to_spec()
+    return spec
+
+def profile_from_spec(spec : dict) -> FinancialProfile:
+    """Build a fresh FinancialProfile (and all its Debt, Investment, ... objects) from a spec."""
+    insurances = dict({name : Insurance(**insurance) for name, insurance in spec["insurances"].items()})
+    profile_arguments = dict({argument : value for argument, value in spec.items()
+                              if argument not in ["debts", "insurances", "investments", "employer_benefits", "monthly_needs", "allocation_policy"]})
+    profile_arguments["federal_tax_brackets"] = [tuple(bracket) for bracket in spec["federal_tax_brackets"]]
+    if "allocation_policy" in spec:
+        profile_arguments["policy"] = AllocationPolicy.from_spec(spec["allocation_policy"])
+    return FinancialProfile(debts = dict({name : Debt(**debt) for name, debt in spec["debts"].items()}),
+                            investments = dict({category : dict({name : Investment(**investment) for name, investment in category_dict.items()})
+                                                for category, category_dict in spec["investments"].items()}),
+                            monthly_needs = dict({name : MonthlyNeededExpenses(**need, insurances=insurances)
+                                                  for name, need in spec["monthly_needs"].items()}),
+                            employer_benefits = dict({name : EmployerBenefits(**job, insurances=insurances)
+                                                      for name, job in spec["employer_benefits"].items()}),
+                            **profile_arguments)
+
+def set_spec_value(spec : dict, path : str, value) -> dict:
+    """Copy of a spec with one value replaced, path is dot separated (i.e. "employer_benefits.Biocore.salary")."""
+    spec = copy.deepcopy(spec)
+    keys = path.split(".")
+    target = spec
+    for key in keys[:-1]:
+        if key not in target:
+            raise KeyError(f"No {key} in profile spec path {path}.")
+        target = target[key]
+    if keys[-1] not in target:
+        raise KeyError(f"No {keys[-1]} in profile spec path {path}.")
+    target[keys[-1]] = value
+    return spec
@@ -0,0 +1,156 @@
+"""On-disk cache of simulate_n_years results, keyed by a hash of the profile spec, the horizon and the code.
+
+Every entry is a directory <key>/ holding the four output tables as Parquet (numbered to keep their order).
+Entries are written to a temporary directory and renamed into place, so a reader never sees half an entry, and the
+least recently used entries are removed once the cache is bigger than max_bytes. Temporary directories of writers that
+died are removed when a cache is opened. Any change to the simulation code starts a fresh set of keys."""
+import functools
+import hashlib
+import json
+import os
+import shutil
+import time
+import numpy as np
+import polars as pl
+from objects import FinancialProfile, ResultTables
+from profile_spec import profile_to_spec, profile_from_spec
+
+CODE_MODULES = ["objects", "helper_functions", "timeline", "profile_spec", "policy"]
+
+@functools.lru_cache(maxsize=None)
+def code_version() -> str:
+    """Hash of the source of every module that decides the simulated numbers."""
+    digest = hashlib.sha256()
+    for module in CODE_MODULES:
+        with open(__import__(module).__file__, "rb") as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+def canonical_value(value):
+    """JSON version of numpy scalars in a spec (ints stay ints, they decide the column dtypes)."""
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    if isinstance(value, np.bool_):
+        return bool(value)
+    raise TypeError(f"Can not hash {type(value).__name__} values of a profile spec.")
+
+def spec_key(spec : dict, years : int, fast_forward = False) -> str:
+    """Cache key of a spec simulated for a number of years."""
+    canonical = json.dumps(dict({"spec" : spec, "years" : years, "fast_forward" : fast_forward, "code" : code_version()}),
+                           sort_keys=True, separators=(",", ":"), default=canonical_value)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+def pid_alive(pid : int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError: # Alive, but owned by another user
+        return True
+    return True
+
+class ResultCache:
+    """Cache directory of simulation results with LRU eviction and hit/miss counts (for this process)."""
+
+    def __init__(self, directory : str = None, max_bytes : int = 2**30):
+        self.directory = directory or os.path.join(os.path.expanduser("~"), ".cache", "financecalc")
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(self.directory, exist_ok=True)
+        self.remove_stale()
+
+    def remove_stale(self, max_age : float = 3600.0):
+        """Remove temporary directories whose writer process is gone, or that are older than max_age seconds."""
+        for name in os.listdir(self.directory):
+            if not name.startswith("_tmp-"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                writer_alive = pid_alive(int(name.rsplit("-", 1)[1]))
+                stale = not writer_alive or time.time() - os.stat(path).st_mtime > max_age
+            except (ValueError, FileNotFoundError):
+                stale = True
+            if stale:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def entries(self) -> list:
+        """Complete entries as (key, last used, bytes), least recently used first."""
+        entries = []
+        for key in os.listdir(self.directory):
+            path = os.path.join(self.directory, key)
+            if key.startswith("_tmp-") or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(entry.stat().st_size for entry in os.scandir(path))
+                entries.append((key, os.stat(path).st_mtime, size))
+            except FileNotFoundError: # Evicted by another process meanwhile
+                continue
+        return sorted(entries, key=lambda entry: entry[1])
+
+    def get(self, key : str) -> ResultTables:
+        """Stored tables of a key (memory-mapped), None if it is not cached."""
+        path = os.path.join(self.directory, key)
+        try:
+            tables = dict({file[len("00-"):-len(".parquet")] : pl.read_parquet(os.path.join(path, file), memory_map=True).lazy()
+                           for file in sorted(os.listdir(path))})
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses+=1
+            return None
+        self.hits+=1
+        return ResultTables(tables)
+
+    def put(self, key : str, results : dict):
+        """Store the tables of a key, then evict least recently used entries until the cache fits in max_bytes."""
+        path = os.path.join(self.directory, key)
+        temporary = os.path.join(self.directory, f"_tmp-{key}-{os.getpid()}")
+        shutil.rmtree(temporary, ignore_errors=True)
+        os.makedirs(temporary)
+        for position, (table, frame) in enumerate(results.items()):
+            frame.write_parquet(os.path.join(temporary, f"{position:02d}-{table}.parquet"))
+        try:
+            os.rename(temporary, path)
+        except OSError: # Stored by another process meanwhile
+            shutil.rmtree(temporary, ignore_errors=True)
+        self.evict(keep=key)
+
+    def evict(self, keep : str = None):
+        entries = self.entries()
+        total = sum(size for key, last_used, size in entries)
+        for key, last_used, size in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
+            total-=size
+            self.evictions+=1
+
+    def simulate(self, profile, years : int, fast_forward = False) -> ResultTables:
+        """simulate_n_years of a profile (or spec) built from scratch, read from the cache when it was run before.
+
+        A profile is only read (as profile_to_spec) and must not have been simulated or have scheduled events."""
+        if isinstance(profile, FinancialProfile):
+            if profile.years_past != 0 or len(profile.timeline) > 0:
+                raise ValueError("Only profiles that have not been simulated and have no scheduled events can be cached.")
+            profile = profile_to_spec(profile)
+        key = spec_key(profile, years, fast_forward)
+        results = self.get(key)
+        if results is None:
+            results = profile_from_spec(profile).simulate_n_years(years, fast_forward=fast_forward)
+            self.put(key, results)
+        return results
+
+    def stats(self) -> dict:
+        entries = self.entries()
+        lookups = self.hits + self.misses
+        return dict({"hits" : self.hits, "misses" : self.misses, "hit_rate" : self.hits / lookups if lookups else 0.0,
+                     "evictions" : self.evictions, "entries" : len(entries), "bytes" : sum(size for key, last_used, size in entries)})
+
+    def clear(self):
+        for key, last_used, size in self.entries():
+            shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
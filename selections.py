@@ -103,4 +103,5 @@ profile = FinancialProfile(debts = debts,
                            max_401K_legal = max_401K_legal, max_IRA_legal = max_IRA_legal, 
                            prioritize_matching_over_emergency_fund=prioritize_matching_over_emergency_fund)
 
-results = profile.simulate_n_years(years=50, verbose = False)
\ No newline at end of file
+if __name__ == "__main__": # Also when run from results.ipynb with %run
+    results = profile.simulate_n_years(years=50, verbose = False)
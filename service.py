@@ -0,0 +1,244 @@
+"""Local simulation service: POST a profile spec, get the simulate_n_years tables back as Arrow IPC streams.
+
+python service.py serve --port 8750                   Serve on localhost (or --unix PATH for a Unix socket)
+python service.py load --port 8750 --requests 200     Load generator: concurrent requests, then the server metrics
+
+POST /simulate?years=50&table=Accounts&fast_forward=1 with a JSON spec (as in a profile file) as the body. table is
+one of the output tables or "long" (see objects.long_results), the response is an Arrow IPC stream, read it with
+polars.read_ipc_stream. GET /metrics returns request counts, latencies and queue depth as JSON.
+
+Simulations run in a process pool. Identical requests (same spec hash, years, fast_forward and table) that arrive while
+one is running share its result, and new simulations are refused with 503 once max_pending are running or waiting."""
+import argparse
+import asyncio
+import collections
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor
+
+TABLES = ["Spent", "Accounts", "Paycheck Only Spending", "Simplified Spending", "long"]
+STATUS = dict({200 : "OK", 400 : "Bad Request", 404 : "Not Found", 405 : "Method Not Allowed", 413 : "Content Too Large",
+               500 : "Internal Server Error", 503 : "Service Unavailable"})
+
+def simulate_table(spec : dict, years : int, fast_forward : bool, table : str) -> bytes:
+    """Worker task: one output table (or the long table) of a spec as Arrow IPC stream bytes, the others are never built."""
+    from profile_spec import profile_from_spec
+    results = profile_from_spec(spec).simulate_n_years(years, fast_forward=fast_forward)
+    frame = results.long().collect() if table == "long" else results[table]
+    buffer = io.BytesIO()
+    frame.write_ipc_stream(buffer)
+    return buffer.getvalue()
+
+class HTTPError(Exception):
+    def __init__(self, status : int, message : str):
+        super().__init__(message)
+        self.status = status
+
+class SimulationService:
+    """Request handling, in-flight coalescing and metrics around a process pool of n_workers (all cores by default).
+
+    Request bodies over max_body_bytes are refused with 413 without reading them."""
+
+    def __init__(self, n_workers = None, max_pending = 64, max_years = 200, latency_window = 10000, max_body_bytes = 2**20):
+        self.n_workers = n_workers or os.cpu_count()
+        self.max_pending = max_pending
+        self.max_years = max_years
+        self.max_body_bytes = max_body_bytes
+        # Spawned, not forked: a forked child can deadlock in polars once the parent has used its thread pool
+        self.executor = ProcessPoolExecutor(max_workers=self.n_workers, mp_context=multiprocessing.get_context("spawn"))
+        self.in_flight = dict() # {request key : future of the table stream}
+        self.latencies = collections.deque(maxlen=latency_window)
+        self.counts = collections.Counter()
+        self.started = time.time()
+
+    async def simulate(self, spec : dict, years : int, fast_forward : bool, table : str) -> bytes:
+        """Table stream of a validated spec, joining a running simulation of the same request if there is one."""
+        from result_cache import spec_key
+        key = (spec_key(spec, years, fast_forward), table)
+        if key in self.in_flight:
+            self.counts["coalesced"]+=1
+        else:
+            if len(self.in_flight) >= self.max_pending:
+                self.counts["rejected"]+=1
+                raise HTTPError(503, f"{len(self.in_flight)} simulations are pending, try again later.")
+            self.counts["simulations"]+=1
+            future = asyncio.get_running_loop().run_in_executor(self.executor, simulate_table, spec, years, fast_forward, table)
+            future.add_done_callback(lambda done: self.in_flight.pop(key, None))
+            self.in_flight[key] = future
+        # Shielded, so a client hanging up does not cancel the simulation for the others waiting on it
+        return await asyncio.shield(self.in_flight[key])
+
+    def metrics(self) -> dict:
+        latencies = sorted(self.latencies)
+        percentile = lambda fraction: latencies[min(int(fraction*len(latencies)), len(latencies) - 1)] if latencies else None
+        return dict({"uptime_seconds" : time.time() - self.started, **self.counts,
+                     "in_flight" : len(self.in_flight), "queue_depth" : max(0, len(self.in_flight) - self.n_workers),
+                     "latency_seconds" : dict({"p50" : percentile(0.5), "p95" : percentile(0.95), "p99" : percentile(0.99),
+                                               "max" : latencies[-1] if latencies else None, "count" : len(latencies)})})
+
+    async def route(self, method : str, target : str, body : bytes):
+        """(content type, response body) of a request."""
+        from profile_config import validate_spec
+        url = urllib.parse.urlsplit(target)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        if url.path == "/metrics":
+            return "application/json", json.dumps(self.metrics()).encode()
+        if url.path != "/simulate":
+            raise HTTPError(404, f"No {url.path}, use POST /simulate or GET /metrics.")
+        if method != "POST":
+            raise HTTPError(405, "POST a profile spec to /simulate.")
+        table = query.get("table", "Accounts")
+        if table not in TABLES:
+            raise HTTPError(400, f"Unknown table {table}, choose from {', '.join(TABLES)}.")
+        try:
+            years = int(query.get("years", 50))
+            spec = validate_spec(json.loads(body))
+        except (ValueError, UnicodeDecodeError) as error:
+            raise HTTPError(400, str(error))
+        if not 1 <= years <= self.max_years:
+            raise HTTPError(400, f"years must be between 1 and {self.max_years}.")
+        stream = await self.simulate(spec, years, query.get("fast_forward", "0") in ["1", "true"], table)
+        return "application/vnd.apache.arrow.stream", stream
+
+    async def handle(self, reader, writer):
+        """One HTTP/1.1 request per connection."""
+        start = time.perf_counter()
+        self.counts["requests"]+=1
+        status, content_type, body = 200, "text/plain", b""
+        is_simulation = False
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            if len(request_line) != 3:
+                raise HTTPError(400, "Malformed request line.")
+            method, target = request_line[0], request_line[1]
+            headers = dict()
+            while (line := await reader.readline()) not in [b"\r\n", b"\n", b""]:
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            length = headers.get("content-length", "0")
+            if not length.isdigit():
+                raise HTTPError(400, "Content-Length must be a non-negative integer.")
+            if int(length) > self.max_body_bytes:
+                raise HTTPError(413, f"Request bodies are limited to {self.max_body_bytes} bytes.")
+            request_body = await reader.readexactly(int(length))
+            is_simulation = target.startswith("/simulate")
+            content_type, body = await self.route(method, target, request_body)
+        except HTTPError as error:
+            status, body = error.status, str(error).encode()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        except Exception as error:
+            status, body = 500, f"{type(error).__name__}: {error}".encode()
+        self.counts[f"status_{status}"]+=1
+        retry = "Retry-After: 1\r\n" if status == 503 else ""
+        writer.write(f"HTTP/1.1 {status} {STATUS[status]}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+                     f"{retry}Connection: close\r\n\r\n".encode() + body)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+        if is_simulation and status == 200:
+            self.latencies.append(time.perf_counter() - start)
+
+    async def serve(self, host = "127.0.0.1", port = 8750, unix_path = None):
+        if unix_path is not None:
+            server = await asyncio.start_unix_server(self.handle, path=unix_path)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+async def request(host : str, port : int, method : str, target : str, body = b"", unix_path = None):
+    """(status, body) of one request to the service."""
+    if unix_path is not None:
+        reader, writer = await asyncio.open_unix_connection(unix_path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    writer.write(f"{method} {target} HTTP/1.1\r\nHost: {host}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, response_body = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), response_body
+
+async def generate_load(spec : dict, host = "127.0.0.1", port = 8750, unix_path = None, n_requests = 200, concurrency = 16,
+                        distinct = 10, years = 50, table = "Accounts", check = False) -> dict:
+    """Send n_requests simulations (distinct different maximum_monthly_loan_payment values, so repeats can coalesce)
+    with at most concurrency open at a time. Returns status counts, client latencies and the server metrics."""
+    bodies = [json.dumps(dict(spec, maximum_monthly_loan_payment=spec["maximum_monthly_loan_payment"] + 10*variant)).encode()
+              for variant in range(distinct)]
+    limit = asyncio.Semaphore(concurrency)
+    statuses, latencies = collections.Counter(), []
+
+    async def one(index):
+        async with limit:
+            start = time.perf_counter()
+            status, body = await request(host, port, "POST", f"/simulate?years={years}&table={urllib.parse.quote(table)}",
+                                         bodies[index % distinct], unix_path)
+            latencies.append(time.perf_counter() - start)
+            statuses[status]+=1
+            if check and status == 200:
+                import polars as pl
+                pl.read_ipc_stream(io.BytesIO(body))
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one(index) for index in range(n_requests)])
+    seconds = time.perf_counter() - start
+    latencies.sort()
+    status, metrics = await request(host, port, "GET", "/metrics", unix_path=unix_path)
+    return dict({"requests" : n_requests, "seconds" : seconds, "requests_per_second" : n_requests/seconds,
+                 "statuses" : dict(statuses), "client_latency_p50" : latencies[len(latencies)//2],
+                 "client_latency_p95" : latencies[min(int(0.95*len(latencies)), len(latencies) - 1)],
+                 "server" : json.loads(metrics)})
+
+def main(arguments = None):
+    parser = argparse.ArgumentParser(description="Local simulation service and its load generator.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_command = commands.add_parser("serve", help="Run the service")
+    serve_command.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    serve_command.add_argument("--max-pending", type=int, default=64, help="Simulations running or waiting before 503s")
+    serve_command.add_argument("--max-body-bytes", type=int, default=2**20, help="Largest request body, bigger ones get a 413")
+    load_command = commands.add_parser("load", help="Send concurrent requests to a running service")
+    load_command.add_argument("--profile", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "examples", "profile.toml"))
+    load_command.add_argument("--requests", type=int, default=200)
+    load_command.add_argument("--concurrency", type=int, default=16)
+    load_command.add_argument("--distinct", type=int, default=10, help="Different specs among the requests")
+    load_command.add_argument("--years", type=int, default=50)
+    load_command.add_argument("--table", default="Accounts", choices=TABLES)
+    load_command.add_argument("--check", action="store_true", help="Parse every response as Arrow IPC")
+    for command in [serve_command, load_command]:
+        command.add_argument("--host", default="127.0.0.1")
+        command.add_argument("--port", type=int, default=8750)
+        command.add_argument("--unix", default=None, help="Unix socket path instead of host and port")
+    arguments = parser.parse_args(arguments)
+
+    if arguments.command == "serve":
+        service = SimulationService(n_workers=arguments.workers, max_pending=arguments.max_pending,
+                                    max_body_bytes=arguments.max_body_bytes)
+        print(f"Serving on {arguments.unix or f'http://{arguments.host}:{arguments.port}'}")
+        try:
+            asyncio.run(service.serve(arguments.host, arguments.port, arguments.unix))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            service.close()
+        return 0
+    from profile_config import load_profile_spec
+    summary = asyncio.run(generate_load(load_profile_spec(arguments.profile), arguments.host, arguments.port, arguments.unix,
+                                        arguments.requests, arguments.concurrency, arguments.distinct, arguments.years,
+                                        arguments.table, arguments.check))
+    print(json.dumps(summary, indent=1))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+"""Sinks that write the chunks of FinancialProfile.stream_n_years to local files.
+
+Every chunk of a table goes to its own numbered file, i.e. directory/Accounts/part-00000.parquet, so nothing is
+rewritten and memory stays bounded by the chunk size. Read the tables back lazily with scan_results."""
+import abc
+import os
+import polars as pl
+
+class ChunkSink(abc.ABC):
+    """Writes {table name : DataFrame} chunks under a directory, subclasses choose the file format."""
+
+    extension = None
+
+    def __init__(self, directory : str):
+        self.directory = directory
+        self.chunks_written = 0
+
+    @abc.abstractmethod
+    def write_table(self, frame : pl.DataFrame, path : str):
+        """Write one chunk of a table to a new file."""
+
+    def write(self, tables : dict):
+        for table, frame in tables.items():
+            table_directory = os.path.join(self.directory, table)
+            os.makedirs(table_directory, exist_ok=True)
+            self.write_table(frame, os.path.join(table_directory, f"part-{self.chunks_written:05d}.{self.extension}"))
+        self.chunks_written+=1
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class ParquetSink(ChunkSink):
+    extension = "parquet"
+
+    def __init__(self, directory : str, compression = "zstd"):
+        super().__init__(directory)
+        self.compression = compression
+
+    def write_table(self, frame, path):
+        frame.write_parquet(path, compression=self.compression)
+
+class IPCSink(ChunkSink):
+    """Arrow IPC (Feather v2) files, fastest to write and memory-mappable when read."""
+    extension = "arrow"
+
+    def write_table(self, frame, path):
+        frame.write_ipc(path)
+
+def stream_to_sink(profile, years : int, sink : ChunkSink, chunk_months = 12, fast_forward = False) -> int:
+    """Simulate a profile chunk by chunk straight into a sink, returns the number of chunks written."""
+    with sink:
+        for tables in profile.stream_n_years(years, chunk_months=chunk_months, fast_forward=fast_forward):
+            sink.write(tables)
+    return sink.chunks_written
+
+def scan_results(directory : str) -> dict:
+    """{table name : LazyFrame} over the chunk files of a sink directory (Parquet or Arrow IPC)."""
+    results = dict()
+    for table in sorted(os.listdir(directory)):
+        files = sorted(os.listdir(os.path.join(directory, table)))
+        if len(files) == 0:
+            continue
+        if files[0].endswith(".parquet"):
+            results[table] = pl.scan_parquet(os.path.join(directory, table, "*.parquet"))
+        else:
+            results[table] = pl.scan_ipc(os.path.join(directory, table, "*.arrow"))
+    return results
@@ -0,0 +1,89 @@
+"""Parameter sweeps over a profile spec (see profile_spec.py).
+
+A parameter is any dot separated spec path, i.e. "maximum_monthly_loan_payment", "savings_leftover_percent"
+or "employer_benefits.Biocore.salary"."""
+import itertools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import polars as pl
+import numpy as np
+from batch import FinancialProfileBatch
+from profile_spec import profile_from_spec, set_spec_value
+
+def grid_combinations(grid : dict) -> list[dict]:
+    """Every combination of {parameter : list of values}."""
+    return [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+
+def random_combinations(ranges : dict, n_samples : int, seed = 0) -> list[dict]:
+    """n_samples random combinations, (low, high) tuples are sampled uniformly and lists are sampled as choices."""
+    rng = np.random.default_rng(seed)
+    samples = dict()
+    for parameter, choices in ranges.items():
+        if isinstance(choices, tuple):
+            samples[parameter] = rng.uniform(choices[0], choices[1], n_samples).tolist()
+        else:
+            samples[parameter] = [choices[index] for index in rng.integers(0, len(choices), n_samples)]
+    return [dict({parameter : values[sample] for parameter, values in samples.items()}) for sample in range(n_samples)]
+
+def summarize_results(results : dict, debt_types : list) -> pl.DataFrame:
+    """Final net worth, debt-free month and total leisure per scenario of (batch) simulate_n_years tables."""
+    accounts, simplified = results["Accounts"], results["Simplified Spending"]
+    if "Scenario" not in accounts.columns:
+        accounts = accounts.with_columns(pl.lit(0).alias("Scenario"))
+        simplified = simplified.with_columns(pl.lit(0).alias("Scenario"))
+    account_columns = [column for column in accounts.columns if column not in ["Scenario", "Years"]]
+    investment_columns = [column for column in account_columns if column not in debt_types]
+    debt_total = pl.sum_horizontal([pl.col(column) for column in debt_types]) if debt_types else pl.lit(0.0)
+    accounts = accounts.with_columns((pl.int_range(pl.len()).over("Scenario") + 1).alias("Month"),
+                                     (pl.sum_horizontal([pl.col(column) for column in investment_columns]) - debt_total).alias("Net Worth"),
+                                     (debt_total <= 0).alias("Debt Free"))
+    summary = accounts.group_by("Scenario", maintain_order=True).agg(pl.col("Net Worth").last().alias("Final Net Worth"),
+                                                                    pl.col("Month").filter(pl.col("Debt Free")).first().alias("Debt Free Month"))
+    leisure = simplified.group_by("Scenario", maintain_order=True).agg(pl.col("Leisure").sum().alias("Total Leisure"))
+    return summary.join(leisure, on="Scenario", how="left").drop("Scenario")
+
+def _run_chunk(base_spec : dict, combinations : list[dict], years : int) -> pl.DataFrame:
+    """Worker task: build the profiles of a chunk from the spec and simulate them together."""
+    specs = []
+    for combination in combinations:
+        spec = base_spec
+        for parameter, value in combination.items():
+            spec = set_spec_value(spec, parameter, value)
+        specs.append(spec)
+    profiles = [profile_from_spec(spec) for spec in specs]
+    debt_types = [debt.type for debt in profiles[0].debts]
+    try:
+        batch = FinancialProfileBatch(profiles)
+    except ValueError:
+        # Combinations change the accounts, simulate one by one
+        return pl.concat([summarize_results(profile.simulate_n_years(years, fast_forward=True), [debt.type for debt in profile.debts])
+                          for profile in profiles], how="vertical")
+    return summarize_results(batch.simulate_n_years(years), debt_types)
+
+def run_sweep(base_spec : dict, combinations : list[dict], years : int, n_workers = None, chunk_size = 64) -> pl.DataFrame:
+    """Simulate every combination of parameter values across a process pool (n_workers, all cores by default).
+
+    Combinations are sent in chunks of chunk_size together with the plain base spec, each worker builds and runs
+    its own profiles. Returns one row per combination: the parameter values, Final Net Worth, Debt Free Month
+    (first month with no debt left, null if never) and Total Leisure."""
+    if len(combinations) == 0:
+        raise ValueError("No combinations to sweep.")
+    n_workers = n_workers or os.cpu_count()
+    chunks = [combinations[start:start + chunk_size] for start in range(0, len(combinations), chunk_size)]
+    if n_workers == 1 or len(chunks) == 1:
+        summaries = [_run_chunk(base_spec, chunk, years) for chunk in chunks]
+    else:
+        # Spawned, not forked: a forked child can deadlock in polars once the parent has used its thread pool
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            summaries = list(executor.map(_run_chunk, itertools.repeat(base_spec), chunks, itertools.repeat(years)))
+    parameters = pl.DataFrame(combinations)
+    return pl.concat([parameters, pl.concat(summaries, how="vertical")], how="horizontal")
+
+def grid_sweep(base_spec : dict, grid : dict, years : int, **kwargs) -> pl.DataFrame:
+    """run_sweep over every combination of {parameter : list of values}."""
+    return run_sweep(base_spec, grid_combinations(grid), years, **kwargs)
+
+def random_sweep(base_spec : dict, ranges : dict, n_samples : int, years : int, seed = 0, **kwargs) -> pl.DataFrame:
+    """run_sweep over n_samples random combinations of {parameter : (low, high) or list of choices}."""
+    return run_sweep(base_spec, random_combinations(ranges, n_samples, seed), years, **kwargs)
@@ -0,0 +1,170 @@
+"""Scheduled events of a FinancialProfile (see FinancialProfile.schedule).
+
+Months count from the start of the profile, month 0 is the first simulated month. An event fires at the start of
+its month, before the month's waterfall. Events replace jobs, needs and the account dicts of the profile instead of
+changing them in place, so snapshots taken before an event still see the old ones."""
+import abc
+import copy
+import heapq
+import itertools
+
+class TimelineEvent(abc.ABC):
+    """Something that happens at the start of a month."""
+
+    def __init__(self, month : int):
+        if month < 0:
+            raise ValueError("Events can not happen before the first month.")
+        self.month = int(month)
+
+    @abc.abstractmethod
+    def apply(self, profile):
+        """Change the profile at the start of the event's month."""
+
+    def __repr__(self):
+        settings = ", ".join(f"{name}={value!r}" for name, value in vars(self).items() if name != "month")
+        return f"{type(self).__name__}(month={self.month}, {settings})"
+
+class SalaryChange(TimelineEvent):
+    """New salary for one job (raise, pay cut, ...)."""
+
+    def __init__(self, month : int, job : str, salary : float):
+        super().__init__(month)
+        self.job = job
+        self.salary = salary
+
+    def apply(self, profile):
+        if self.job not in profile.employer_benefits:
+            raise ValueError(f"No job {self.job} to change the salary of.")
+        job = copy.copy(profile.employer_benefits[self.job])
+        job.salary = type(job.salary)(self.salary)
+        job.monthly_gross = job.salary/12
+        profile.update_jobs(dict({self.job : job}))
+
+class JobChange(TimelineEvent):
+    """Start (or replace) a job with new EmployerBenefits, or leave it when employer_benefits is None."""
+
+    def __init__(self, month : int, job : str, employer_benefits = None):
+        super().__init__(month)
+        self.job = job
+        self.employer_benefits = employer_benefits
+
+    def apply(self, profile):
+        profile.update_jobs(dict({self.job : self.employer_benefits}))
+
+class NeedChange(TimelineEvent):
+    """New monthly costs (rent, food, electric, internet or minimum_excess_expendature) of one MonthlyNeededExpenses."""
+
+    costs = ["rent", "food", "electric", "internet", "minimum_excess_expendature"]
+
+    def __init__(self, month : int, need : str, **costs):
+        super().__init__(month)
+        for cost in costs:
+            if cost not in self.costs:
+                raise ValueError(f"Unknown need cost {cost}, choose from {', '.join(self.costs)}.")
+        self.need = need
+        self.new_costs = costs
+
+    def apply(self, profile):
+        if self.need not in profile.monthly_needs:
+            raise ValueError(f"No need {self.need} to change.")
+        need = copy.copy(profile.monthly_needs[self.need])
+        for cost, value in self.new_costs.items():
+            setattr(need, cost, value)
+        profile.update_needs(dict({self.need : need}))
+
+class RentChange(NeedChange):
+    def __init__(self, month : int, need : str, rent : float):
+        super().__init__(month, need, rent=rent)
+
+class Windfall(TimelineEvent):
+    """One-off amount added to an investment (the first short term account by default), i.e. a bonus or inheritance."""
+
+    def __init__(self, month : int, amount : float, account : str = None):
+        super().__init__(month)
+        self.amount = amount
+        self.account = account
+
+    def apply(self, profile):
+        profile.add_to_account(self.amount, self.account)
+
+class OneOffExpense(Windfall):
+    """One-off amount taken out of an investment (the first short term account by default), i.e. a car repair."""
+
+    def apply(self, profile):
+        profile.add_to_account(-self.amount, self.account)
+
+class OpenAccount(TimelineEvent):
+    """Add a Debt (category "Debts") or an Investment (category as in the investments dict) under a name.
+
+    The profile gets its own copy of the account, so the same event can be used in several profiles or forks."""
+
+    def __init__(self, month : int, name : str, account, category : str):
+        super().__init__(month)
+        self.name = name
+        self.account = account
+        self.category = category
+
+    def apply(self, profile):
+        profile.open_account(self.name, copy.copy(self.account), self.category)
+
+class NewDebt(OpenAccount):
+    def __init__(self, month : int, name : str, debt):
+        super().__init__(month, name, debt, "Debts")
+
+class CloseAccount(TimelineEvent):
+    """Remove a debt (writing off what is left) or investment. The balance of an investment moves to the transfer_to
+    investment if given."""
+
+    def __init__(self, month : int, name : str, transfer_to : str = None):
+        super().__init__(month)
+        self.name = name
+        self.transfer_to = transfer_to
+
+    def apply(self, profile):
+        profile.close_account(self.name, self.transfer_to)
+
+class Timeline:
+    """Priority queue of pending events by month (events of the same month fire in the order they were scheduled).
+
+    Fired events are kept, so the timeline can be rewound to an earlier month when a profile is restored."""
+
+    def __init__(self):
+        self.pending = []
+        self.fired = []
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def push(self, event : TimelineEvent):
+        heapq.heappush(self.pending, (event.month, next(self.counter), event))
+
+    @property
+    def next_month(self):
+        """Month of the next pending event (infinity if there is none)."""
+        return self.pending[0][0] if self.pending else float("inf")
+
+    @property
+    def last_fired_month(self):
+        return max((month for month, order, event in self.fired), default=-float("inf"))
+
+    def pop_due(self, month : int) -> list:
+        """Remove and return the events due by a month, in firing order."""
+        due = []
+        while self.pending and self.pending[0][0] <= month:
+            entry = heapq.heappop(self.pending)
+            self.fired.append(entry)
+            due.append(entry[2])
+        return due
+
+    def rewind(self, month : int):
+        """Make events of this month and later pending again."""
+        for entry in [entry for entry in self.fired if entry[0] >= month]:
+            self.fired.remove(entry)
+            heapq.heappush(self.pending, entry)
+
+    def copy(self) -> "Timeline":
+        timeline = copy.copy(self)
+        timeline.pending = list(self.pending)
+        timeline.fired = list(self.fired)
+        return timeline